@@ -1,29 +1,260 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import json
 import os
 from datetime import datetime
 import uuid
-from docx import Document
-from docx.shared import Inches
 import io
+import itertools
+import math
+import secrets
+import unicodedata
+from urllib.parse import quote
+from document_generator import DocumentGenerator, GENERATOR_VERSION, changed_wizard_sections
+from render_cache import RenderCache, SingleFlight
+from batch_export import ExportRegistry, render_in_parallel, stream_zip
+from render_pool import RenderPool, RenderQueueFull, RenderTimeout
+from render_jobs import JobQueue, DONE, FAILED
+from storage import create_storage, encode_cursor, decode_cursor, SQLiteStorage
+from search_index import SearchIndex, SQLiteSearchIndex
+from rate_limit import TokenBucketLimiter
+from templating import TEMPLATES_DIR
+from pdf_export import PdfUnavailable
+from html_preview import negotiate_encoding, compress
+from metrics import metrics, MetricsMiddleware, SlowRequestProfiler
+from auth import DEFAULT_ITERATIONS, SessionSigner, TokenCache, hash_password, verify_password, needs_rehash, dummy_hash
 
 app = Flask(__name__)
 CORS(app)
 
-# Хранилище данных в памяти
-users_db = {}
-documents_db = {}
+# Хранилище данных: 'memory' (словари в памяти) или 'sqlite:///path/to/howdo.db'
+storage = create_storage(os.environ.get('HOWDO_STORAGE', 'memory'))
+
+# Поисковый индекс по документам; уже сохраненные документы индексируются при первом поиске или в preload().
+# С SQLite индекс лежит в той же базе (FTS5) и общий для всех воркеров
+search_index = SQLiteSearchIndex(storage.connection) if isinstance(storage, SQLiteStorage) else SearchIndex()
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Кэш готовых .docx (бюджет в байтах задается через окружение)
+RENDER_CACHE_BYTES = int(os.environ.get('HOWDO_RENDER_CACHE_BYTES', 64 * 1024 * 1024))
+render_cache = RenderCache(max_bytes=RENDER_CACHE_BYTES)
+
+# Кэш XML разделов СОК: после правки ответов заново собираются только изменившиеся разделы.
+# Разделы собираются по частям только потоковым backend (HOWDO_DOCX_BACKEND=stream);
+# воркеры пула рендера держат такой же кэш каждый у себя
+FRAGMENT_CACHE_BYTES = int(os.environ.get('HOWDO_FRAGMENT_CACHE_BYTES', 16 * 1024 * 1024))
+fragment_cache = RenderCache(max_bytes=FRAGMENT_CACHE_BYTES)
+generator = DocumentGenerator(
+    bytecode_cache_dir=os.environ.get('HOWDO_JINJA_CACHE_DIR'),
+    fragment_cache=fragment_cache
+)
+
+# Кэш сжатого HTML-предпросмотра (по содержимому и кодировке)
+PREVIEW_CACHE_BYTES = int(os.environ.get('HOWDO_PREVIEW_CACHE_BYTES', 16 * 1024 * 1024))
+preview_cache = RenderCache(max_bytes=PREVIEW_CACHE_BYTES)
+
+# Backend генерации .docx: 'python-docx' (эталонный) или 'stream' (потоковая запись OOXML).
+# python-docx после каждой правки строит документ целиком, stream берет неизмененные разделы из кэша
+DOCX_BACKEND = os.environ.get('HOWDO_DOCX_BACKEND', 'python-docx')
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+EXPORT_FORMATS = {
+    'docx': DOCX_MIMETYPE,
+    'pdf': 'application/pdf'
+}
+
+# Пакетная выгрузка: число потоков рендера и прогресс последних выгрузок
+EXPORT_WORKERS = int(os.environ.get('HOWDO_EXPORT_WORKERS', min(4, os.cpu_count() or 1)))
+exports = ExportRegistry()
+
+# Пул процессов для рендера (0 - рендер в потоке запроса)
+RENDER_WORKERS = int(os.environ.get('HOWDO_RENDER_WORKERS', 0))
+RENDER_QUEUE = int(os.environ.get('HOWDO_RENDER_QUEUE', RENDER_WORKERS * 4))
+RENDER_TIMEOUT = float(os.environ.get('HOWDO_RENDER_TIMEOUT', 30))
+render_pool = None
+if RENDER_WORKERS > 0:
+    render_pool = RenderPool(
+        RENDER_WORKERS, TEMPLATES_DIR, max_queue=RENDER_QUEUE, timeout=RENDER_TIMEOUT,
+        fragment_cache_bytes=FRAGMENT_CACHE_BYTES
+    )
+
+# Одновременные скачивания одного документа ждут один рендер вместо своих копий
+renders = SingleFlight(wait_timeout=RENDER_TIMEOUT)
+
+# Частота рендера на пользователя (без входа - на IP): HOWDO_RATE_LIMIT запросов
+# в секунду с запасом HOWDO_RATE_BURST; 0 отключает ограничение
+RATE_LIMIT = float(os.environ.get('HOWDO_RATE_LIMIT', 2))
+RATE_BURST = int(os.environ.get('HOWDO_RATE_BURST', 20))
+rate_limiter = TokenBucketLimiter(RATE_LIMIT, RATE_BURST) if RATE_LIMIT > 0 else None
+
+# Предпросмотр мастера вызывается на каждое сохранение ответа и без входа считается по IP
+# (за прокси - один на всех), поэтому у него свое, более щедрое ведро:
+# HOWDO_PREVIEW_RATE_LIMIT в секунду с запасом HOWDO_PREVIEW_RATE_BURST; 0 отключает
+PREVIEW_RATE_LIMIT = float(os.environ.get('HOWDO_PREVIEW_RATE_LIMIT', 20))
+PREVIEW_RATE_BURST = int(os.environ.get('HOWDO_PREVIEW_RATE_BURST', 200))
+preview_rate_limiter = TokenBucketLimiter(PREVIEW_RATE_LIMIT, PREVIEW_RATE_BURST) if PREVIEW_RATE_LIMIT > 0 else None
+RATE_LIMITED_ENDPOINTS = frozenset({
+    'create_document_from_wizard',
+    'download_document',
+    'preview_document',
+    'export_documents',
+    'render_document_job'
+})
+
+# register и login считают PBKDF2 на каждый запрос, поэтому у них свое ведро, не связанное
+# с рендером: login считается по email (перебор паролей одной учетной записи), register -
+# по IP клиента. HOWDO_AUTH_RATE_LIMIT в секунду с запасом HOWDO_AUTH_RATE_BURST; 0 отключает
+AUTH_RATE_LIMIT = float(os.environ.get('HOWDO_AUTH_RATE_LIMIT', 1))
+AUTH_RATE_BURST = int(os.environ.get('HOWDO_AUTH_RATE_BURST', 10))
+auth_rate_limiter = TokenBucketLimiter(AUTH_RATE_LIMIT, AUTH_RATE_BURST) if AUTH_RATE_LIMIT > 0 else None
+AUTH_ENDPOINTS = frozenset({'register', 'login'})
+
+# Число доверенных обратных прокси перед приложением: с ним remote_addr берется из
+# X-Forwarded-For, и ограничения по IP считаются для клиента, а не для прокси
+TRUSTED_PROXIES = int(os.environ.get('HOWDO_TRUSTED_PROXIES', 0))
+
+# Режим фоновых задач: /api/wizard сразу ставит рендер в очередь
+RENDER_JOBS = os.environ.get('HOWDO_RENDER_JOBS', '0') == '1'
+JOB_WORKERS = int(os.environ.get('HOWDO_JOB_WORKERS', 2))
+
+# Размер страницы GET /api/documents
+DOCUMENTS_PAGE_SIZE = 100
+DOCUMENTS_MAX_PAGE_SIZE = 500
+
+# Метрики запросов; профиль пишется для запросов дольше HOWDO_PROFILE_SLOW_MS
+PROFILE_SLOW_MS = os.environ.get('HOWDO_PROFILE_SLOW_MS')
+profiler = None
+if PROFILE_SLOW_MS:
+    profiler = SlowRequestProfiler(float(PROFILE_SLOW_MS) / 1000, os.environ.get('HOWDO_PROFILE_DIR', 'profiles'))
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+app.wsgi_app = MetricsMiddleware(app.wsgi_app, metrics, profiler)
+
+# Пароли хэшируются PBKDF2 с HOWDO_PASSWORD_ITERATIONS итерациями; после входа
+# клиент передает токен в заголовке Authorization: Bearer <token>.
+# HOWDO_SECRET_KEY должен быть общим у всех воркеров, иначе токен одного
+# не примет другой; без него ключ случайный и токены не переживают перезапуск
+PASSWORD_ITERATIONS = int(os.environ.get('HOWDO_PASSWORD_ITERATIONS', DEFAULT_ITERATIONS))
+SESSION_MAX_AGE = int(os.environ.get('HOWDO_SESSION_MAX_AGE', 24 * 3600))
+sessions = SessionSigner(
+    os.environ.get('HOWDO_SECRET_KEY') or secrets.token_hex(32),
+    max_age=SESSION_MAX_AGE,
+    cache=TokenCache(
+        max_entries=int(os.environ.get('HOWDO_TOKEN_CACHE_SIZE', 10000)),
+        ttl=int(os.environ.get('HOWDO_TOKEN_CACHE_TTL', 300))
+    )
+)
+
+# Маршруты с документами пользователя требуют токен ('0' - прежний режим с user_id в запросе)
+AUTH_REQUIRED = os.environ.get('HOWDO_AUTH_REQUIRED', '1') == '1'
+PROTECTED_ENDPOINTS = frozenset({
+    'create_document_from_wizard',
+    'get_documents',
+    'search_documents',
+    'update_document',
+    'delete_document',
+    'download_document',
+    'preview_document',
+    'export_documents',
+    'render_document_job',
+    'job_status',
+    'job_artifact'
+})
+
+@app.before_request
+def label_route():
+    # Метка маршрута - шаблон правила, а не путь: иначе каждый doc_id дает новую серию
+    request.environ['howdo.route'] = request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def authenticate():
+    # Подпись проверяется только при первом появлении токена, дальше он берется из кэша
+    g.user_id = None
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        g.user_id = sessions.verify(header[len('Bearer '):])
+    
+    # Предварительный запрос CORS приходит без заголовка Authorization
+    if AUTH_REQUIRED and g.user_id is None and request.method != 'OPTIONS' \
+            and request.endpoint in PROTECTED_ENDPOINTS:
+        return jsonify({"error": "Требуется вход"}), 401
+
+@app.before_request
+def limit_rate():
+    if request.endpoint == 'preview_answers':
+        limiter = preview_rate_limiter
+    elif request.endpoint in AUTH_ENDPOINTS:
+        limiter = auth_rate_limiter
+    elif request.endpoint in RATE_LIMITED_ENDPOINTS:
+        limiter = rate_limiter
+    else:
+        limiter = None
+    if limiter is None or request.method == 'OPTIONS':
+        return None
+    
+    # За обратным прокси без HOWDO_TRUSTED_PROXIES remote_addr - адрес прокси;
+    # вошедшие пользователи считаются по токену, вход - по email
+    email = (request.get_json(silent=True) or {}).get('email') if request.endpoint == 'login' else None
+    if isinstance(email, str) and email:
+        key = f"email:{email}"
+    elif g.user_id is not None:
+        key = f"user:{g.user_id}"
+    else:
+        key = f"ip:{request.remote_addr}"
+    retry_after = limiter.acquire(key)
+    if retry_after:
+        response = jsonify({"error": "Слишком много запросов, повторите позже"})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        return response
+    return None
+
+def owned_document(doc_id):
+    """Документ вошедшего пользователя; чужой документ выглядит как отсутствующий"""
+    doc_data = storage.get_document(doc_id)
+    if doc_data is None or (g.user_id is not None and doc_data["user_id"] != g.user_id):
+        return None
+    return doc_data
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/api/health')
 def health():
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "users_count": len(users_db),
-        "documents_count": len(documents_db)
+        "users_count": storage.count_users(),
+        "documents_count": storage.count_documents(),
+        "render_cache": render_cache.stats(),
+        "fragment_cache": fragment_cache.stats(),
+        "render_pool": render_pool.stats() if render_pool else None,
+        "render_jobs": render_jobs.stats(),
+        "session_cache": sessions.cache.stats(),
+        "search_index": search_index.stats(),
+        "render_flights": renders.stats(),
+        "rate_limiter": rate_limiter.stats() if rate_limiter else None,
+        "auth_rate_limiter": auth_rate_limiter.stats() if auth_rate_limiter else None,
+        "preview_rate_limiter": preview_rate_limiter.stats() if preview_rate_limiter else None
     })
 
+@app.errorhandler(RenderQueueFull)
+def render_queue_full(error):
+    response = jsonify({"error": "Сервер перегружен, повторите запрос позже"})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.errorhandler(PdfUnavailable)
+def pdf_unavailable(error):
+    return jsonify({"error": "Экспорт в PDF недоступен на сервере"}), 501
+
+@app.errorhandler(RenderTimeout)
+def render_timeout(error):
+    return jsonify({"error": "Превышено время генерации документа"}), 504
+
 @app.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
@@ -33,16 +264,20 @@ def register():
     if not email or not password:
         return jsonify({"error": "Email и пароль обязательны"}), 400
     
-    if email in users_db:
+    # Занятый email отклоняется до дорогого хэширования пароля
+    if storage.get_user_by_email(email) is not None:
         return jsonify({"error": "Пользователь уже существует"}), 400
     
     user_id = str(uuid.uuid4())
-    users_db[email] = {
+    created = storage.add_user({
         "id": user_id,
         "email": email,
-        "password": password,
+        "password": hash_password(password, PASSWORD_ITERATIONS),
         "created_at": datetime.now().isoformat()
-    }
+    })
+    
+    if not created:
+        return jsonify({"error": "Пользователь уже существует"}), 400
     
     return jsonify({
         "message": "Пользователь зарегистрирован",
@@ -55,134 +290,465 @@ def login():
     email = data.get('email')
     password = data.get('password')
     
-    if email not in users_db:
-        return jsonify({"error": "Неверные учетные данные"}), 401
+    if not email or not password:
+        return jsonify({"error": "Email и пароль обязательны"}), 400
     
-    user = users_db[email]
-    if user["password"] != password:
+    # Неизвестный email сверяется с хэшем-пустышкой: время ответа не выдает, кто зарегистрирован
+    user = storage.get_user_by_email(email)
+    stored = user["password"] if user is not None else dummy_hash(PASSWORD_ITERATIONS)
+    if not verify_password(password, stored) or user is None:
         return jsonify({"error": "Неверные учетные данные"}), 401
     
+    # Открытые пароли старых записей и хэши с прежним числом итераций обновляются при входе
+    if needs_rehash(user["password"], PASSWORD_ITERATIONS):
+        storage.update_user_password(email, hash_password(password, PASSWORD_ITERATIONS))
+    
     return jsonify({
         "message": "Успешный вход",
-        "user": {"id": user["id"], "email": email}
+        "user": {"id": user["id"], "email": email},
+        "token": sessions.issue(user["id"]),
+        "expires_in": SESSION_MAX_AGE
     })
 
 @app.route('/api/wizard', methods=['POST'])
 def create_document_from_wizard():
     data = request.get_json()
-    user_id = data.get('user_id', 'anonymous')
+    # При HOWDO_AUTH_REQUIRED=1 маршрут без токена не пропускается, владелец - вошедший пользователь
+    user_id = g.user_id or data.get('user_id', 'anonymous')
     answers = data.get('answers', {})
     
     # Создаем документ
     doc_id = str(uuid.uuid4())
     
     # Сохраняем в базу
-    documents_db[doc_id] = {
+    document = {
         "id": doc_id,
         "user_id": user_id,
-        "title": answers.get('q2', 'Стандартная операционная карта'),
+        "title": document_title(answers),
         "answers": answers,
         "created_at": datetime.now().isoformat()
     }
+    storage.add_document(document)
+    search_index.add(document)
     
-    return jsonify({
+    response = {
         "message": "Стандарт создан успешно!",
         "document_id": doc_id
-    })
+    }
+    
+    # В режиме задач рендер начинается сразу, а скачивание только отдает готовые байты
+    if RENDER_JOBS or data.get('render'):
+        response["job_id"] = submit_render(doc_id)
+    
+    return jsonify(response)
+
+def document_title(answers):
+    # q2: null или пустая строка дают название по умолчанию на любом хранилище (в SQLite title NOT NULL)
+    return answers.get('q2') or 'Стандартная операционная карта'
+
+def submit_render(doc_id):
+    """id фоновой задачи рендера или None, если очередь заполнена"""
+    try:
+        return render_jobs.submit(doc_id).id
+    except RenderQueueFull:
+        # Документ сохранен; рендер можно запросить позже через /render
+        return None
 
 @app.route('/api/documents')
 def get_documents():
-    user_id = request.args.get('user_id')
+    user_id = g.user_id or request.args.get('user_id')
+    order = request.args.get('order', 'asc')
+    
+    try:
+        limit = min(int(request.args.get('limit', DOCUMENTS_PAGE_SIZE)), DOCUMENTS_MAX_PAGE_SIZE)
+        after = request.args.get('after')
+        after = decode_cursor(after) if after else None
+    except ValueError:
+        return jsonify({"error": "Некорректные параметры пагинации"}), 400
+    
+    if limit < 1 or order not in ('asc', 'desc'):
+        return jsonify({"error": "Некорректные параметры пагинации"}), 400
+    
+    # Берем на один документ больше, чтобы узнать, есть ли следующая страница
+    page = storage.list_user_documents(user_id, limit=limit + 1, after=after, descending=order == 'desc')
     
     user_documents = []
-    for doc_id, doc in documents_db.items():
-        if doc["user_id"] == user_id:
-            user_documents.append({
-                "id": doc_id,
-                "title": doc["title"],
-                "created_at": doc["created_at"]
-            })
+    for doc in page[:limit]:
+        user_documents.append({
+            "id": doc["id"],
+            "title": doc["title"],
+            "created_at": doc["created_at"]
+        })
+    
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    
+    return jsonify({"documents": user_documents, "next_cursor": next_cursor})
+
+@app.route('/api/documents/search')
+def search_documents():
+    user_id = g.user_id or request.args.get('user_id')
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Укажите поисковый запрос"}), 400
     
-    return jsonify({"documents": user_documents})
+    try:
+        limit = min(int(request.args.get('limit', SEARCH_PAGE_SIZE)), SEARCH_MAX_PAGE_SIZE)
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "Некорректные параметры пагинации"}), 400
+    
+    if limit < 1 or offset < 0:
+        return jsonify({"error": "Некорректные параметры пагинации"}), 400
+    
+    search_index.ensure_loaded(storage.iter_documents)
+    total, page = search_index.search(user_id, query, limit=limit, offset=offset)
+    
+    results = []
+    for doc_id, title, created_at, score in page:
+        results.append({
+            "id": doc_id,
+            "title": title,
+            "created_at": created_at,
+            "score": round(score, 4)
+        })
+    
+    next_offset = offset + limit if offset + limit < total else None
+    
+    return jsonify({"results": results, "total": total, "next_offset": next_offset})
+
+@app.route('/api/documents/<doc_id>', methods=['PATCH'])
+def update_document(doc_id):
+    doc_data = owned_document(doc_id)
+    if doc_data is None:
+        return jsonify({"error": "Документ не найден"}), 404
+    
+    data = request.get_json() or {}
+    changes = data.get('answers')
+    if not isinstance(changes, dict):
+        return jsonify({"error": "Укажите изменяемые ответы"}), 400
+    
+    # Правка частичная: не переданные ответы остаются прежними
+    answers = {**doc_data["answers"], **changes}
+    changed_sections = changed_wizard_sections(doc_data["answers"], answers)
+    # Ответы вне разделов СОК тоже сохраняются, хотя документ от них не меняется
+    if answers != doc_data["answers"]:
+        title = document_title(answers)
+        storage.update_document(doc_id, answers, title)
+        search_index.add({**doc_data, "title": title, "answers": answers})
+    
+    response = {
+        "message": "Стандарт обновлен",
+        "document_id": doc_id,
+        "changed_sections": changed_sections
+    }
+    
+    if changed_sections and (RENDER_JOBS or data.get('render')):
+        response["job_id"] = submit_render(doc_id)
+    
+    return jsonify(response)
+
+@app.route('/api/documents/<doc_id>', methods=['DELETE'])
+def delete_document(doc_id):
+    if owned_document(doc_id) is None or not storage.delete_document(doc_id):
+        return jsonify({"error": "Документ не найден"}), 404
+    search_index.remove(doc_id)
+    
+    return jsonify({"message": "Документ удален"})
 
 @app.route('/api/documents/<doc_id>/download')
 def download_document(doc_id):
-    if doc_id not in documents_db:
+    doc_data = owned_document(doc_id)
+    if doc_data is None:
         return jsonify({"error": "Документ не найден"}), 404
     
-    doc_data = documents_db[doc_id]
     answers = doc_data["answers"]
     
-    # Создаем Word документ с правильной структурой
-    doc = Document()
-    
-    # Заголовок СОК
-    title = f"СОК: {answers.get('q2', 'Не указано')}"
-    doc.add_heading(title, 0)
-    
-    # Информация о документе
-    doc.add_heading('Информация о документе', level=1)
-    
-    info_table = doc.add_table(rows=4, cols=2)
-    info_table.style = 'Table Grid'
-    
-    # Заполняем таблицу информации
-    info_data = [
-        ('Компания:', answers.get('q1', 'Не указано')),
-        ('Операция:', answers.get('q2', 'Не указано')),
-        ('Исполнители:', answers.get('q3', 'Не указано')),
-        ('Дата создания:', datetime.now().strftime('%d.%m.%Y'))
-    ]
-    
-    for i, (label, value) in enumerate(info_data):
-        info_table.cell(i, 0).text = label
-        info_table.cell(i, 1).text = value
-    
-    # Описание
-    doc.add_heading('Описание', level=1)
-    description = answers.get('q4', 'Стандартная процедура выполнения операции')
-    doc.add_paragraph(description)
-    
-    # Шаги выполнения
-    doc.add_heading('Шаги выполнения', level=1)
-    steps = answers.get('q5', '').split('\n')
-    for i, step in enumerate(steps, 1):
-        if step.strip():
-            doc.add_paragraph(f"{i}. {step.strip()}")
-    
-    # Требования безопасности
-    doc.add_heading('Требования безопасности', level=1)
-    safety = answers.get('q6', '').split('\n')
-    for requirement in safety:
-        if requirement.strip():
-            doc.add_paragraph(requirement.strip(), style='List Bullet')
-    
-    # Контроль качества
-    doc.add_heading('Контроль качества', level=1)
-    quality = answers.get('q7', '').split('\n')
-    for check in quality:
-        if check.strip():
-            doc.add_paragraph(check.strip(), style='List Bullet')
-    
-    # Ожидаемые результаты
-    if answers.get('q8'):
-        doc.add_heading('Ожидаемые результаты', level=1)
-        doc.add_paragraph(answers.get('q8', ''))
-    
-    # Сохраняем в память
-    file_stream = io.BytesIO()
-    doc.save(file_stream)
-    file_stream.seek(0)
-    
-    filename = f"{answers.get('q2', 'document').replace(' ', '_')}.docx"
+    export_format = request.args.get('format', 'docx')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Неизвестный формат"}), 400
+    
+    creation_date, cache_key = render_context(doc_data, export_format)
+    if cache_key in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(cache_key)
+        return response
+    
+    filename = f"{(answers.get('q2') or 'document').replace(' ', '_')}.{export_format}"
+    
+    if export_format == 'docx' and DOCX_BACKEND == 'stream' and render_pool is None:
+        data = render_cache.get(cache_key)
+        if data is None:
+            # Первый запрос генерирует документ, остальные ждут его байты только до конца генерации
+            flight = renders.lead(cache_key)
+            if flight is None:
+                data = render_document(answers, creation_date, cache_key)
+            else:
+                chunks = generator.stream_wizard_docx(answers, creation_date)
+                data, chunks = lead_stream_render(chunks, cache_key, flight)
+                if data is None:
+                    return stream_docx_response(chunks, filename, cache_key)
+    else:
+        data = render_document(answers, creation_date, cache_key, export_format=export_format)
+    
+    return send_file(
+        io.BytesIO(data),
+        as_attachment=True,
+        download_name=filename,
+        mimetype=EXPORT_FORMATS[export_format],
+        etag=cache_key
+    )
+
+@app.route('/api/documents/<doc_id>/preview')
+def preview_document(doc_id):
+    doc_data = owned_document(doc_id)
+    if doc_data is None:
+        return jsonify({"error": "Документ не найден"}), 404
+    
+    creation_date, cache_key = render_context(doc_data, 'html')
+    return preview_response(doc_data["answers"], creation_date, cache_key, conditional=True)
+
+@app.route('/api/preview', methods=['POST'])
+def preview_answers():
+    data = request.get_json() or {}
+    answers = data.get('answers', {})
+    creation_date = datetime.now().strftime('%d.%m.%Y')
+    cache_key = RenderCache.make_key(
+        {"answers": answers, "creation_date": creation_date, "format": "html"}, GENERATOR_VERSION
+    )
+    return preview_response(answers, creation_date, cache_key)
+
+def preview_response(answers, creation_date, cache_key, conditional=False):
+    """Сжатый HTML-предпросмотр; одинаковые ответы отдаются из кэша без рендера"""
+    encoding = negotiate_encoding(request.accept_encodings)
+    variant_key = f"{cache_key}-{encoding or 'identity'}"
+    if conditional and variant_key in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(variant_key)
+        response.vary.add('Accept-Encoding')
+        return response
+    
+    body = preview_cache.get(variant_key)
+    if body is None:
+        html = generator.render_wizard_html(answers, creation_date)
+        body = compress(html.encode('utf-8'), encoding)
+        preview_cache.put(variant_key, body)
+    
+    response = app.response_class(body, mimetype='text/html')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(variant_key)
+    return response
+
+@app.route('/api/documents/export', methods=['POST'])
+def export_documents():
+    data = request.get_json() or {}
+    doc_ids = data.get('doc_ids')
+    user_id = g.user_id or data.get('user_id')
+    
+    if doc_ids is None and user_id is None:
+        return jsonify({"error": "Укажите doc_ids или user_id"}), 400
     
+    if doc_ids is None:
+        documents = {doc["id"]: doc for doc in storage.list_user_documents(user_id)}
+    else:
+        documents = {doc_id: owned_document(doc_id) for doc_id in doc_ids}
+    
+    missing = [doc_id for doc_id, doc in documents.items() if doc is None]
+    if missing:
+        return jsonify({"error": "Документ не найден", "missing": missing}), 404
+    
+    progress = exports.create(len(documents))
+    
+    def entry_name(doc_id):
+        title = documents[doc_id]["title"].replace(' ', '_').replace('/', '_')
+        return f"{title}_{doc_id[:8]}.docx"
+    
+    results = render_in_parallel(documents, render_stored_document, EXPORT_WORKERS)
+    response = Response(
+        stream_with_context(stream_zip(results, progress, entry_name)),
+        mimetype='application/zip'
+    )
+    response.headers.set('Content-Disposition', 'attachment', filename='documents.zip')
+    response.headers['X-Export-Id'] = progress.id
+    return response
+
+@app.route('/api/exports/<export_id>')
+def export_status(export_id):
+    progress = exports.get(export_id)
+    if progress is None:
+        return jsonify({"error": "Выгрузка не найдена"}), 404
+    
+    return jsonify(progress.to_dict())
+
+@app.route('/api/documents/<doc_id>/render', methods=['POST'])
+def render_document_job(doc_id):
+    if owned_document(doc_id) is None:
+        return jsonify({"error": "Документ не найден"}), 404
+    
+    job = render_jobs.submit(doc_id)
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = render_jobs.get(job_id)
+    if job is None or owned_document(job.document_id) is None:
+        return jsonify({"error": "Задача не найдена"}), 404
+    
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/artifact')
+def job_artifact(job_id):
+    job = render_jobs.get(job_id)
+    doc_data = owned_document(job.document_id) if job is not None else None
+    if doc_data is None:
+        return jsonify({"error": "Задача не найдена"}), 404
+    if job.status == FAILED:
+        return jsonify({"error": job.error}), 500
+    if job.status != DONE:
+        return jsonify(job.to_dict()), 202
+    
+    # Байты берутся из кэша по ключу ответов, с которыми шел рендер. Вытесненный файл
+    # рендерится заново, только если документ с тех пор не меняли
+    data = render_cache.get(job.cache_key)
+    if data is None:
+        creation_date, cache_key = render_context(doc_data)
+        if cache_key != job.cache_key:
+            return jsonify({"error": "Документ изменен после рендера, запустите рендер заново"}), 410
+        data = render_document(doc_data["answers"], creation_date, cache_key)
+    
+    filename = f"{(doc_data['answers'].get('q2') or 'document').replace(' ', '_')}.docx"
+    
+    # ETag - ключ ответов, по которым шел рендер: после правки документа он отличается от текущего
     return send_file(
-        file_stream,
+        io.BytesIO(data),
         as_attachment=True,
         download_name=filename,
-        mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+        mimetype=DOCX_MIMETYPE,
+        etag=job.cache_key
+    )
+
+def render_context(doc_data, export_format='docx'):
+    """Дата создания и ключ кэша документа в заданном формате"""
+    creation_date = datetime.fromisoformat(doc_data["created_at"]).strftime('%d.%m.%Y')
+    # Ключ кэша зависит только от содержимого документа, формата и версии генератора
+    cache_key = RenderCache.make_key(
+        {
+            "answers": doc_data["answers"],
+            "creation_date": creation_date,
+            "format": export_format,
+            "backend": DOCX_BACKEND if export_format == 'docx' else None
+        },
+        GENERATOR_VERSION
     )
+    return creation_date, cache_key
+
+def render_document(answers, creation_date, cache_key, wait_for_slot=False, export_format='docx'):
+    """
+    Готовые байты документа: из кэша или новая генерация (.docx выбранным backend, PDF).
+    При включенном пуле процессов генерация выполняется в воркере
+    """
+    data = render_cache.get(cache_key)
+    if data is None:
+        data = renders.do(
+            cache_key, lambda: render_uncached(answers, creation_date, cache_key, wait_for_slot, export_format)
+        )
+    return data
+
+def render_uncached(answers, creation_date, cache_key, wait_for_slot, export_format):
+    # Пока ждали очередь к рендеру, его мог закончить другой запрос
+    data = render_cache.peek(cache_key)
+    if data is not None:
+        return data
+    if export_format == 'pdf':
+        if render_pool is not None:
+            data = render_pool.render_wizard_pdf(answers, creation_date, wait_for_slot)
+        else:
+            data = generator.render_wizard_pdf(answers, creation_date)
+    elif render_pool is not None:
+        data = render_pool.render_wizard(answers, creation_date, DOCX_BACKEND, wait_for_slot)
+    else:
+        data = generator.render_wizard_bytes(answers, creation_date, DOCX_BACKEND)
+    render_cache.put(cache_key, data)
+    return data
+
+def render_stored_document(doc_id):
+    """Рендер сохраненного документа по id (пакетная выгрузка)"""
+    doc_data = storage.get_document(doc_id)
+    creation_date, cache_key = render_context(doc_data)
+    return render_document(doc_data["answers"], creation_date, cache_key, wait_for_slot=True)
+
+def render_job(doc_id):
+    """Рендер для фоновой задачи: ключ кэша версии документа и байты"""
+    doc_data = storage.get_document(doc_id)
+    creation_date, cache_key = render_context(doc_data)
+    return cache_key, render_document(doc_data["answers"], creation_date, cache_key, wait_for_slot=True)
+
+render_jobs = JobQueue(render_job, workers=JOB_WORKERS)
+
+def lead_stream_render(chunks, cache_key, flight):
+    """
+    Ведущий рендер потоковым backend. Документ в пределах бюджета кэша собирается целиком,
+    попадает в кэш и сразу достается запросам, ждущим flight, - не дожидаясь, пока клиент
+    ведущего скачает файл. Для большего документа возвращает (None, порции): начало уже
+    сгенерировано, остаток отдается потоком, а ждущие рендерят сами
+    """
+    chunks = iter(chunks)
+    collected = []
+    collected_size = 0
+    data = None
+    try:
+        # Предыдущий ведущий мог закончить между проверкой кэша и lead()
+        data = render_cache.peek(cache_key)
+        if data is not None:
+            return data, None
+        for chunk in chunks:
+            collected.append(chunk)
+            collected_size += len(chunk)
+            if collected_size > render_cache.max_bytes:
+                return None, itertools.chain(collected, chunks)
+        data = b''.join(collected)
+        render_cache.put(cache_key, data)
+        return data, None
+    finally:
+        renders.finish(cache_key, flight, data)
+
+def stream_docx_response(chunks, filename, cache_key):
+    """Отдает .docx по мере генерации (документы больше бюджета кэша)"""
+    response = Response(stream_with_context(chunks), mimetype=DOCX_MIMETYPE)
+    try:
+        filename.encode('ascii')
+        names = {"filename": filename}
+    except UnicodeEncodeError:
+        names = {
+            "filename": unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii'),
+            "filename*": f"UTF-8''{quote(filename)}"
+        }
+    response.headers.set('Content-Disposition', 'attachment', **names)
+    response.set_etag(cache_key)
+    return response
+
+def preload():
+    """
+    Прогрев рендера в этом процессе: импорт python-docx, заготовки документов,
+    фрагменты HTML и при HOWDO_PRELOAD_PDF=1 WeasyPrint, а также поисковый индекс.
+    Без прогрева всё это загружается при первом рендере или поиске. Под gunicorn
+    --preload выполняется в мастере до fork, поэтому пул процессов здесь не запускается
+    """
+    generator.warm_up()
+    search_index.ensure_loaded(storage.iter_documents)
+    if os.environ.get('HOWDO_PRELOAD_PDF') == '1':
+        try:
+            generator.pdf_renderer.warm_up(generator.template_mapping.values())
+        except PdfUnavailable:
+            pass
+
+# Воркеры рендера прогреваются при импорте, легкие воркеры стартуют без python-docx
+if os.environ.get('HOWDO_PRELOAD') == '1':
+    preload()
 
 if __name__ == '__main__':
+    preload()
+    if render_pool is not None:
+        render_pool.warm_up()
     app.run(host='0.0.0.0', port=5000, debug=True)
-
@@ -0,0 +1,251 @@
+"""
+ASGI-точка входа для API без дополнительных зависимостей:
+
+    uvicorn asgi:application --workers 4
+
+Обработчики те же, что у WSGI-приложения Flask. Легкие маршруты (health,
+список документов, статусы задач) выполняются прямо в цикле событий, тяжелые
+(рендер, скачивание, выгрузка, поиск, запись в хранилище) - в пуле потоков с ограниченным числом
+одновременных запросов. Ожидание места в пуле и медленные клиенты не занимают
+потоков, поэтому не мешают дешевым запросам
+"""
+
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+
+import app as wsgi
+
+# Endpoint'ы Flask, которые отвечают за миллисекунды и не рендерят документы.
+# Регистрации и входа здесь нет: хэш пароля нарочно дорогой и занял бы цикл событий.
+# Поиска тоже: ранжирование по большому индексу занимает сотни миллисекунд.
+# Правка и удаление документа пишут в SQLite и могут ждать чужую блокировку записи
+# до busy_timeout, поэтому тоже выполняются в пуле
+LIGHT_ENDPOINTS = frozenset({
+    'health',
+    'metrics_endpoint',
+    'get_documents',
+    'export_status',
+    'job_status',
+    'render_document_job'
+})
+
+RENDER_CONCURRENCY = int(os.environ.get('HOWDO_ASGI_RENDER_CONCURRENCY', min(8, (os.cpu_count() or 1) * 2)))
+
+# Сколько порций тела ответа поток рендера может опережать клиента
+STREAM_BUFFER = 8
+
+_DONE = object()
+
+
+def build_environ(scope, body):
+    """WSGI environ по ASGI scope и прочитанному телу запроса"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0] if client else '',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').lower()
+        value = raw_value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _start_message(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    }
+
+
+class AsgiAdapter:
+    def __init__(self, flask_app, light_endpoints=LIGHT_ENDPOINTS, max_concurrency=RENDER_CONCURRENCY,
+                 on_startup=None, on_shutdown=None):
+        self.flask_app = flask_app
+        self.light_endpoints = light_endpoints
+        self.max_concurrency = max_concurrency
+        self.on_startup = on_startup
+        self.on_shutdown = on_shutdown
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='asgi-render')
+        # Семафор создается в цикле событий сервера при первом запросе
+        self._slots = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        body = await self._read_body(receive)
+        environ = build_environ(scope, body)
+        if self._is_light(environ):
+            await self._call_inline(environ, send)
+        else:
+            await self._call_offloaded(environ, send)
+
+    async def _lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.on_startup is not None:
+                    await loop.run_in_executor(None, self.on_startup)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                if self.on_shutdown is not None:
+                    self.on_shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    def _is_light(self, environ):
+        try:
+            endpoint, _ = self.flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            # 404 и 405 отвечаются сразу
+            return True
+        return endpoint in self.light_endpoints
+
+    async def _call_inline(self, environ, send):
+        """Легкий запрос: WSGI-приложение вызывается прямо в цикле событий"""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['message'] = _start_message(status, headers)
+
+        result = self.flask_app(environ, start_response)
+        try:
+            data = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        await send(started['message'])
+        await send({'type': 'http.response.body', 'body': data})
+
+    async def _call_offloaded(self, environ, send):
+        """
+        Тяжелый запрос: приложение и перебор тела ответа идут в одном потоке пула
+        (контекст Flask в stream_with_context привязан к потоку), порции тела
+        передаются в цикл событий через ограниченную очередь
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue(maxsize=STREAM_BUFFER)
+        cancelled = False
+
+        def put(message):
+            asyncio.run_coroutine_threadsafe(messages.put(message), loop).result()
+
+        def run():
+            def start_response(status, headers, exc_info=None):
+                put(_start_message(status, headers))
+
+            try:
+                result = self.flask_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if cancelled:
+                            break
+                        if chunk:
+                            put({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            except Exception as error:
+                put(error)
+            finally:
+                put(_DONE)
+
+        async with self._slots:
+            loop.run_in_executor(self._executor, run)
+            started = False
+            failure = None
+            try:
+                while True:
+                    message = await messages.get()
+                    if message is _DONE:
+                        break
+                    if isinstance(message, Exception):
+                        if started:
+                            failure = message
+                        elif started is False:
+                            await send(_start_message('500 INTERNAL SERVER ERROR', [('Content-Type', 'text/plain')]))
+                            await send({'type': 'http.response.body', 'body': b'Internal Server Error'})
+                            started = None
+                        continue
+                    if message['type'] == 'http.response.start':
+                        started = True
+                    if started:
+                        await send(message)
+                if started and failure is None:
+                    await send({'type': 'http.response.body', 'body': b''})
+            except BaseException:
+                # Клиент отключился: поток дочитывает очередь и завершается сам
+                cancelled = True
+                while await messages.get() is not _DONE:
+                    pass
+                raise
+        if failure is not None:
+            # Заголовки уже ушли: ответ не завершается, сервер рвет соединение,
+            # и клиент не примет обрезанное тело за успешный ответ
+            raise failure
+
+
+def _startup():
+    # Первичная загрузка индекса долгая, ей не место в легком запросе поиска
+    wsgi.search_index.ensure_loaded(wsgi.storage.iter_documents)
+    if wsgi.render_pool is not None:
+        wsgi.render_pool.warm_up()
+
+
+def _shutdown():
+    if wsgi.render_pool is not None:
+        wsgi.render_pool.shutdown()
+
+
+application = AsgiAdapter(wsgi.app, on_startup=_startup, on_shutdown=_shutdown)
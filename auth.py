@@ -0,0 +1,142 @@
+"""
+Пароли и сессии
+Пароли хранятся как PBKDF2-SHA256 с настраиваемым числом итераций, после входа
+выдается подписанный HMAC токен. Проверенные токены кэшируются с TTL, поэтому
+дорогой хэш считается только при входе, а запрос с токеном стоит поиска в словаре
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+HASH_ALGORITHM = 'pbkdf2_sha256'
+# Рекомендация OWASP для PBKDF2-HMAC-SHA256; меньше - только для разработки
+DEFAULT_ITERATIONS = 600000
+SALT_BYTES = 16
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def hash_password(password, iterations=DEFAULT_ITERATIONS):
+    """Строка вида pbkdf2_sha256$итерации$соль$хэш"""
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f"{HASH_ALGORITHM}${iterations}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def verify_password(password, stored):
+    """Сверка за постоянное время; пароли, сохраненные до хэширования, сравниваются как есть"""
+    if not stored.startswith(HASH_ALGORITHM + '$'):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    _, iterations, salt, digest = stored.split('$')
+    candidate = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), _b64decode(salt), int(iterations))
+    return hmac.compare_digest(candidate, _b64decode(digest))
+
+
+@lru_cache(maxsize=None)
+def dummy_hash(iterations=DEFAULT_ITERATIONS):
+    """Хэш случайного пароля: вход с неизвестным email сверяется с ним за то же время"""
+    return hash_password(secrets.token_urlsafe(16), iterations)
+
+
+def needs_rehash(stored, iterations=DEFAULT_ITERATIONS):
+    """True для открытого пароля или хэша с другим числом итераций"""
+    if not stored.startswith(HASH_ALGORITHM + '$'):
+        return True
+    return int(stored.split('$')[1]) != iterations
+
+
+class TokenCache:
+    """Проверенные токены: token -> (user_id, момент истечения записи), LRU с ограничением размера"""
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token, user_id, expires_in):
+        # Запись живет не дольше самого токена
+        expires_at = time.monotonic() + min(self.ttl, expires_in)
+        with self._lock:
+            self._entries[token] = (user_id, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+class SessionSigner:
+    """
+    Токен сессии: base64(JSON с user_id и сроком) + '.' + HMAC-SHA256 подписи.
+    Состояние на сервере не нужно, поэтому токен принимают все воркеры с тем же ключом
+    """
+    def __init__(self, secret, max_age=24 * 3600, cache=None):
+        self.secret = secret.encode('utf-8') if isinstance(secret, str) else secret
+        self.max_age = max_age
+        self.cache = cache
+
+    def _signature(self, payload):
+        return hmac.new(self.secret, payload.encode('ascii'), hashlib.sha256).digest()
+
+    def issue(self, user_id):
+        payload = _b64encode(json.dumps(
+            {"uid": user_id, "exp": int(time.time()) + self.max_age, "n": secrets.token_hex(4)},
+            separators=(',', ':')
+        ).encode('utf-8'))
+        return f"{payload}.{_b64encode(self._signature(payload))}"
+
+    def verify(self, token):
+        """user_id владельца токена или None для поддельного и просроченного"""
+        if self.cache is not None:
+            user_id = self.cache.get(token)
+            if user_id is not None:
+                return user_id
+        try:
+            payload, signature = token.split('.')
+            if not hmac.compare_digest(_b64decode(signature), self._signature(payload)):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, UnicodeError):
+            return None
+        expires_in = claims.get("exp", 0) - time.time()
+        if expires_in <= 0:
+            return None
+        if self.cache is not None:
+            self.cache.put(token, claims["uid"], expires_in)
+        return claims["uid"]
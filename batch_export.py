@@ -0,0 +1,116 @@
+"""
+Пакетная выгрузка документов одним zip-архивом
+Документы рендерятся параллельно ограниченным пулом и пишутся в архив по мере готовности
+"""
+
+import io
+import threading
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class ExportProgress:
+    def __init__(self, total):
+        self.id = str(uuid.uuid4())
+        self.total = total
+        self.completed = 0
+        self.failed = []
+        self.done = False
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "total": self.total,
+            "completed": self.completed,
+            "failed": list(self.failed),
+            "done": self.done
+        }
+
+
+class ExportRegistry:
+    """Прогресс последних выгрузок для GET /api/exports/<export_id>"""
+    def __init__(self, max_entries=100):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, total):
+        progress = ExportProgress(total)
+        with self._lock:
+            self._entries[progress.id] = progress
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return progress
+
+    def get(self, export_id):
+        with self._lock:
+            return self._entries.get(export_id)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Несдвигаемый поток для zipfile: записанные байты забираются через drain()"""
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def render_in_parallel(items, render, max_workers):
+    """
+    Выполняет render(item) в пуле потоков и отдает (item, result, error) по мере готовности.
+    В работе одновременно не больше max_workers * 2 задач, поэтому готовые
+    документы не накапливаются в памяти
+    """
+    items = iter(items)
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    pending = {}
+
+    def submit_next():
+        for item in items:
+            pending[pool.submit(render, item)] = item
+            return
+
+    try:
+        for _ in range(max_workers * 2):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                error = future.exception()
+                yield item, None if error else future.result(), error
+                submit_next()
+    finally:
+        # Клиент мог оборвать соединение: незапущенные задачи отменяем
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def stream_zip(results, progress, entry_name):
+    """
+    results - итерируемые (item, data, error) из render_in_parallel;
+    генератор байтов архива, каждый документ дописывается сразу после рендера
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for item, data, error in results:
+            if error is not None:
+                progress.failed.append(item)
+                continue
+            # .docx уже сжат, повторно не сжимаем
+            archive.writestr(entry_name(item), data)
+            progress.completed += 1
+            yield sink.drain()
+    progress.done = True
+    yield sink.drain()
@@ -0,0 +1,243 @@
+"""
+Бенчмарк генерации документов и API
+Генерирует синтетические ответы мастера разного размера, замеряет время, пиковую память
+и размер результата для каждого генератора, а также нагрузку на эндпоинты Flask
+через test client. Результат пишется в JSON для сравнения между запусками:
+
+    python benchmark.py --sizes 10,100,1000,5000 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+WORDS = (
+    'проверить затянуть установить деталь шаблон соединение болт гайка ключ '
+    'динамометрический момент затяжки контроль маркировка заготовка сварной шов '
+    'оператор участок смена инструмент калибр зазор поверхность очистить смазать'
+).split()
+
+
+def cyrillic_text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def synthetic_answers(steps, seed=0, words_per_step=25):
+    """Ответы мастера (q1..q8) с заданным числом шагов и длинным кириллическим текстом"""
+    rng = random.Random(seed)
+    return {
+        'q1': 'ООО «Машиностроительный завод имени Калинина»',
+        'q2': f'Сборка узла {steps}',
+        'q3': 'Слесарь-сборщик 4 разряда, мастер участка',
+        'q4': cyrillic_text(rng, 60),
+        'q5': '\n'.join(cyrillic_text(rng, words_per_step) for _ in range(steps)),
+        'q6': '\n'.join(cyrillic_text(rng, 12) for _ in range(max(3, steps // 10))),
+        'q7': '\n'.join(cyrillic_text(rng, 12) for _ in range(max(3, steps // 10))),
+        'q8': cyrillic_text(rng, 40)
+    }
+
+
+def synthetic_data(steps, seed=0, words_per_step=25):
+    """Данные для generate_*_docx (company_name, process_steps, ...)"""
+    rng = random.Random(seed)
+    return {
+        'company_name': 'ООО «Машиностроительный завод имени Калинина»',
+        'business_area': 'Машиностроение',
+        'process_name': f'Сборка узла {steps}',
+        'target_audience': 'Слесари-сборщики',
+        'process_steps': ' '.join(
+            f'{i}. {cyrillic_text(rng, words_per_step)}' for i in range(1, steps + 1)
+        ),
+        'required_resources': cyrillic_text(rng, 30),
+        'expected_results': cyrillic_text(rng, 30),
+        'author': 'Иванов И.И.'
+    }
+
+
+def measure(fn, repeat):
+    """
+    Время (мин/медиана), пиковая память последнего прогона и размер результата.
+    tracemalloc видит только память Python: узлы lxml в python-docx не учитываются
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'min_ms': round(min(timings) * 1000, 3),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'peak_memory_bytes': peak,
+        'output_bytes': len(result) if result is not None else None
+    }
+
+
+def bench_generators(sizes, repeat, reference_limit):
+    from document_generator import DocumentGenerator
+    import io
+
+    generator = DocumentGenerator()
+    generator.warm_up()
+
+    def saved(doc):
+        stream = io.BytesIO()
+        doc.save(stream)
+        return stream.getvalue()
+
+    results = []
+    for steps in sizes:
+        data = synthetic_data(steps)
+        answers = synthetic_answers(steps)
+        cases = {
+            'sok_stream': lambda: b''.join(generator.stream_sok_docx(data)),
+            'instruction_stream': lambda: b''.join(generator.stream_instruction_docx(data)),
+            'procedure_stream': lambda: b''.join(generator.stream_procedure_docx(data)),
+            'wizard_stream': lambda: b''.join(generator.stream_wizard_docx(answers, '01.01.2026')),
+            'wizard_html_preview': lambda: generator.render_wizard_html(answers, '01.01.2026').encode('utf-8'),
+            'sok_simple_html': lambda: generator.generate_sok_html(data).encode('utf-8')
+        }
+        # Эталонный backend python-docx на больших объемах может работать очень долго
+        if steps <= reference_limit:
+            cases.update({
+                'sok_docx': lambda: saved(generator.generate_sok_docx(data)),
+                'instruction_docx': lambda: saved(generator.generate_instruction_docx(data)),
+                'procedure_docx': lambda: saved(generator.generate_procedure_docx(data)),
+                'wizard_docx': lambda: saved(generator.generate_wizard_docx(answers, '01.01.2026'))
+            })
+        for name, fn in sorted(cases.items()):
+            result = measure(fn, repeat)
+            result.update({'benchmark': name, 'steps': steps})
+            results.append(result)
+            print(f"{name:24} steps={steps:<6} median={result['median_ms']:>10.1f} ms "
+                  f"peak={result['peak_memory_bytes'] / 1024:>9.0f} KiB")
+    return results
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_load(app, path, concurrency, requests_per_client, method='get', json_body=None, headers=None):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def client():
+        test_client = app.test_client()
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            response = getattr(test_client, method)(path, json=json_body, headers=headers)
+            response.get_data()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    return {
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / wall, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'statuses': {str(code): count for code, count in statuses.items()}
+    }
+
+
+def bench_endpoints(sizes, concurrency_levels, requests_per_client):
+    # Все запросы идут от одного пользователя и IP: ограничения частоты исказили бы замер
+    for variable in ('HOWDO_RATE_LIMIT', 'HOWDO_PREVIEW_RATE_LIMIT', 'HOWDO_AUTH_RATE_LIMIT'):
+        os.environ.setdefault(variable, '0')
+    import app as application
+
+    flask_app = application.app
+    client = flask_app.test_client()
+    credentials = {'email': 'bench@example.com', 'password': 'bench'}
+    client.post('/api/register', json=credentials)
+    token = client.post('/api/login', json=credentials).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    results = []
+    for steps in sizes:
+        answers = synthetic_answers(steps)
+        doc_id = client.post(
+            '/api/wizard', json={'answers': answers}, headers=headers
+        ).get_json()['document_id']
+        cache_budget = application.render_cache.max_bytes
+        scenarios = [
+            ('health', '/api/health', 'get', None, None),
+            ('documents_list', '/api/documents', 'get', None, None),
+            ('download_cold', f'/api/documents/{doc_id}/download', 'get', None, 0),
+            ('download_cached', f'/api/documents/{doc_id}/download', 'get', None, cache_budget),
+            ('preview', f'/api/documents/{doc_id}/preview', 'get', None, None),
+            ('preview_post', '/api/preview', 'post', {'answers': answers}, None)
+        ]
+        for name, path, method, body, budget in scenarios:
+            for concurrency in concurrency_levels:
+                # Бюджет 0 отключает кэш готовых файлов: каждый запрос рендерит заново
+                if budget is not None:
+                    application.render_cache.clear()
+                    application.render_cache.max_bytes = budget
+                result = run_load(flask_app, path, concurrency, requests_per_client, method, body, headers)
+                result.update({'benchmark': name, 'steps': steps, 'concurrency': concurrency})
+                results.append(result)
+                print(f"{name:16} steps={steps:<6} c={concurrency:<3} "
+                      f"p50={result['p50_ms']:>9.1f} ms p99={result['p99_ms']:>9.1f} ms "
+                      f"rps={result['throughput_rps']:>8.1f}")
+        application.render_cache.max_bytes = cache_budget
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,100,1000,5000', help='число шагов через запятую')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--reference-limit', type=int, default=5000,
+                        help='максимум шагов для эталонного backend python-docx')
+    parser.add_argument('--concurrency', default='1,4,16')
+    parser.add_argument('--requests', type=int, default=5, help='запросов на одного клиента')
+    parser.add_argument('--endpoint-sizes', default='10,100,1000')
+    parser.add_argument('--skip-endpoints', action='store_true')
+    parser.add_argument('--output', default='bench.json')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'generators': bench_generators(sizes, args.repeat, args.reference_limit),
+        'endpoints': []
+    }
+    if not args.skip_endpoints:
+        report['endpoints'] = bench_endpoints(
+            [int(size) for size in args.endpoint_sizes.split(',')],
+            [int(level) for level in args.concurrency.split(',')],
+            args.requests
+        )
+
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(report, output, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
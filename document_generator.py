@@ -3,32 +3,155 @@
 ИСПРАВЛЕННАЯ ВЕРСИЯ с правильным mapping данных
 """
 
+import copy
 import json
 import os
+import threading
 from datetime import datetime
-from docx import Document
-from docx.shared import Inches, Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.table import WD_TABLE_ALIGNMENT
-from docx.oxml.shared import OxmlElement, qn
-import re
+import io
+import docx_stream as ooxml
+from templating import TEMPLATES_DIR, create_environment, wizard_sok_context
+from pdf_export import PdfRenderer
+from html_preview import HtmlPreviewRenderer
+from metrics import metrics
+from render_cache import RenderCache
+from text_parser import parse_list, parse_steps
+
+# python-docx (lxml и ~80 модулей) импортируется внутри методов при первом рендере:
+# воркерам, которые отвечают только на вход и списки, он не нужен.
+# Прогрев заранее - DocumentGenerator.warm_up()
+
+# Версия генератора: увеличивать при любом изменении вида документов,
+# чтобы кэш готовых файлов не отдавал устаревшую вёрстку
+GENERATOR_VERSION = '3'
+
+APPROVAL_HEADERS = ['Разработал', 'Проверил', 'Утвердил']
+
+# Статичные части документов каждого типа: собираются один раз на процесс
+SKELETON_SPECS = {
+    'sok': {
+        'title': 'СТАНДАРТНАЯ ОПЕРАЦИОННАЯ КАРТА (СОК)',
+        'info_labels': ['Компания:', 'Операция:', 'Исполнители:', 'Дата создания:'],
+        'approval_centered': True,
+        'approval_bold': True
+    },
+    'instruction': {
+        'title': 'РАБОЧАЯ ИНСТРУКЦИЯ',
+        'info_labels': ['Компания:', 'Процесс:', 'Целевая аудитория:', 'Версия:', 'Дата создания:'],
+        'approval_centered': False,
+        'approval_bold': False
+    },
+    'procedure': {
+        'title': 'СТАНДАРТ ПРОЦЕДУРЫ',
+        'info_labels': ['Компания:', 'Процедура:', 'Ответственные:', 'Версия:', 'Дата создания:'],
+        'approval_centered': False,
+        'approval_bold': False
+    },
+    # СОК по ответам мастера: заголовок зависит от данных, блока согласования нет
+    'wizard': {
+        'title': None,
+        'info_heading': 'Информация о документе',
+        'info_labels': ['Компания:', 'Операция:', 'Исполнители:', 'Дата создания:']
+    }
+}
+
+# Разделы СОК мастера по порядку и поля ответов, от которых зависит каждый раздел:
+# при правке ответов заново собираются только разделы с изменившимися полями
+WIZARD_SECTIONS = (
+    ('title', ('q2',)),
+    ('info', ('q1', 'q2', 'q3', 'creation_date')),
+    ('description', ('q4',)),
+    ('steps', ('q5',)),
+    ('safety', ('q6',)),
+    ('quality', ('q7',)),
+    ('results', ('q8',))
+)
+
+# Нет ответа: разделы мастера обрабатывают его иначе, чем ответ null
+_MISSING = object()
+
+
+def changed_wizard_sections(old_answers, new_answers):
+    """Имена разделов СОК мастера, которые затрагивает правка ответов"""
+    return [
+        name for name, fields in WIZARD_SECTIONS
+        if any(old_answers.get(field, _MISSING) != new_answers.get(field, _MISSING) for field in fields)
+    ]
+
+
+def bulk_table(rows, block_width, align=None, bold_header=False):
+    """
+    Элемент w:tbl (стиль Table Grid) сразу со всеми строками: XML собирается
+    за один проход и разбирается один раз. Заполнение через table.cell(i, j)
+    обходит сетку на каждый вызов, и большие таблицы строятся за квадратичное время
+    """
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
+    
+    xml = ooxml.table(rows, block_width, align, bold_header)
+    return parse_xml(xml.replace('<w:tbl>', f'<w:tbl {nsdecls("w")}>', 1))
+
+
+def replace_table(table, rows, block_width, align=None, bold_header=False):
+    """Подменяет таблицу документа (например, из заготовки) на bulk_table с новыми значениями"""
+    element = bulk_table(rows, block_width, align, bold_header)
+    table._tbl.addnext(element)
+    table._tbl.getparent().remove(table._tbl)
+    return element
+
+
+class DocumentSkeleton:
+    """
+    Разобранный документ со статичными частями: стиль, заголовок, подписи
+    таблицы информации (начало) и блок согласования с подписью платформы (конец).
+    Для каждого запроса делается deepcopy вместо Document() и повторной вёрстки
+    """
+    def __init__(self, document, head_size, tail_size):
+        self.document = document
+        self.head_size = head_size
+        self.tail_size = tail_size
+        from docx.shared import Emu
+        
+        # Ширина области текста в twips - по ней считаются колонки таблиц
+        section = document.sections[-1]
+        self.block_width = Emu(section.page_width - section.left_margin - section.right_margin).twips
+
+    def clone(self):
+        # lxml не учитывает memo при deepcopy, поэтому Document берется
+        # заново от скопированной части, а не из копии обёртки
+        doc = copy.deepcopy(self.document).part.document
+        body = doc.element.body
+        blocks = [child for child in body.iterchildren() if child is not body.sectPr]
+        tail = blocks[self.head_size:self.head_size + self.tail_size]
+        return doc, tail
+
 
 class DocumentGenerator:
-    def __init__(self, templates_dir="/home/ubuntu/templates"):
+    def __init__(self, templates_dir=TEMPLATES_DIR, bytecode_cache_dir=None, fragment_cache=None):
         self.templates_dir = templates_dir
         self.template_mapping = {
             'sok': 'sok_template.html',
             'instruction': 'instruction_template.html', 
             'procedure': 'procedure_template.html'
         }
+        # Jinja-окружение и PDF-рендерер живут всё время жизни генератора
+        self.environment = create_environment(templates_dir, bytecode_cache_dir)
+        self.pdf_renderer = PdfRenderer(self.environment)
+        self.html_renderer = HtmlPreviewRenderer(self.environment)
+        self._skeletons = {}
+        self._stream_writers = {}
+        self._skeletons_lock = threading.Lock()
+        # Готовый XML разделов СОК мастера (RenderCache), None - без кэша
+        self.fragment_cache = fragment_cache
     
-    def generate_sok_docx(self, data):
-        """
-        Генерирует СОК в формате Word
-        Принимает data словарь с ключами:
-        - company_name, business_area, process_name, target_audience, 
-        - process_steps, required_resources, expected_results
-        """
+    def _build_skeleton(self, doc_type):
+        from docx import Document
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+        from docx.shared import Pt
+        
+        spec = SKELETON_SPECS[doc_type]
+        if spec['title'] is None:
+            return self._build_wizard_skeleton(spec)
         doc = Document()
         
         # Настройка стилей
@@ -38,63 +161,146 @@ class DocumentGenerator:
         font.size = Pt(12)
         
         # Заголовок
-        title = doc.add_heading('СТАНДАРТНАЯ ОПЕРАЦИОННАЯ КАРТА (СОК)', 0)
+        title = doc.add_heading(spec['title'], 0)
         title.alignment = WD_ALIGN_PARAGRAPH.CENTER
         
-        # Основная информация
+        # Основная информация (таблица с значениями подставляется на каждый запрос)
         doc.add_paragraph()
-        info_table = doc.add_table(rows=4, cols=2)
+        info_table = doc.add_table(rows=len(spec['info_labels']), cols=2)
         info_table.style = 'Table Grid'
+        head_size = len(doc.element.body) - 1
         
-        # ИСПРАВЛЕННЫЙ MAPPING ДАННЫХ:
-        info_data = [
-            ('Компания:', data.get('company_name', 'Не указано')),
-            ('Операция:', data.get('process_name', 'Не указано')),
-            ('Исполнители:', data.get('target_audience', 'Не указано')),
-            ('Дата создания:', data.get('creation_date', datetime.now().strftime('%d.%m.%Y')))
+        # Согласование
+        doc.add_paragraph()
+        heading = doc.add_heading('СОГЛАСОВАНИЕ', 2)
+        if spec['approval_centered']:
+            heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        
+        # Таблица согласования с подписями подставляется на каждый запрос
+        approval_table = doc.add_table(rows=2, cols=3)
+        approval_table.style = 'Table Grid'
+        
+        # Подпись платформы
+        doc.add_paragraph()
+        footer = doc.add_paragraph('Создано с помощью платформы HowDo')
+        footer.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+        tail_size = len(doc.element.body) - 1 - head_size
+        
+        return DocumentSkeleton(doc, head_size, tail_size)
+    
+    def _build_wizard_skeleton(self, spec):
+        from docx import Document
+        
+        doc = Document()
+        
+        # Текст заголовка подставляется на каждый запрос
+        doc.add_heading('', 0)
+        doc.add_heading(spec['info_heading'], level=1)
+        
+        info_table = doc.add_table(rows=len(spec['info_labels']), cols=2)
+        info_table.style = 'Table Grid'
+        
+        return DocumentSkeleton(doc, len(doc.element.body) - 1, 0)
+    
+    def _skeleton(self, doc_type):
+        skeleton = self._skeletons.get(doc_type)
+        if skeleton is None:
+            with self._skeletons_lock:
+                skeleton = self._skeletons.get(doc_type)
+                if skeleton is None:
+                    skeleton = self._build_skeleton(doc_type)
+                    self._skeletons[doc_type] = skeleton
+        return skeleton
+    
+    def _stream_writer(self, doc_type):
+        writer = self._stream_writers.get(doc_type)
+        if writer is None:
+            skeleton = self._skeleton(doc_type)
+            with self._skeletons_lock:
+                writer = self._stream_writers.get(doc_type)
+                if writer is None:
+                    # Стили, настройки и прочие части пакета берутся из заготовки
+                    package = io.BytesIO()
+                    skeleton.document.save(package)
+                    writer = ooxml.StreamingDocxWriter(package.getvalue(), skeleton.block_width)
+                    self._stream_writers[doc_type] = writer
+        return writer
+    
+    def warm_up(self):
+        """Заранее собирает заготовки всех типов документов"""
+        for doc_type in SKELETON_SPECS:
+            self._skeleton(doc_type)
+            self._stream_writer(doc_type)
+        self.html_renderer.warm_up(self.template_mapping.values())
+    
+    def _start_document(self, doc_type, info_values):
+        """Клонирует заготовку и подставляет таблицу информации со значениями"""
+        skeleton = self._skeleton(doc_type)
+        with metrics.stage('document'):
+            doc, tail = skeleton.clone()
+        with metrics.stage('tables'):
+            labels = SKELETON_SPECS[doc_type]['info_labels']
+            replace_table(
+                doc.tables[0],
+                [(label, str(value)) for label, value in zip(labels, info_values)],
+                skeleton.block_width
+            )
+        return doc, tail
+    
+    def _finish_document(self, doc_type, doc, tail, data):
+        """Переносит блок согласования в конец и заполняет подписи"""
+        body = doc.element.body
+        for element in tail:
+            body.sectPr.addprevious(element)
+        
+        signatures = [
+            f"{data.get(key, '_________________')}\n(подпись, дата)"
+            for key in ('author', 'coordinator', 'approver')
         ]
         
-        for i, (label, value) in enumerate(info_data):
-            info_table.cell(i, 0).text = label
-            info_table.cell(i, 1).text = str(value)
+        with metrics.stage('tables'):
+            replace_table(
+                doc.tables[-1],
+                [APPROVAL_HEADERS, signatures],
+                self._skeleton(doc_type).block_width,
+                bold_header=SKELETON_SPECS[doc_type]['approval_bold']
+            )
+        
+        return doc
+    
+    def generate_sok_docx(self, data):
+        """
+        Генерирует СОК в формате Word
+        Принимает data словарь с ключами:
+        - company_name, business_area, process_name, target_audience, 
+        - process_steps, required_resources, expected_results
+        """
+        data = ooxml.clean_fields(data)
+        from docx.enum.text import WD_ALIGN_PARAGRAPH
+        
+        # ИСПРАВЛЕННЫЙ MAPPING ДАННЫХ:
+        doc, tail = self._start_document('sok', [
+            data.get('company_name', 'Не указано'),
+            data.get('process_name', 'Не указано'),
+            data.get('target_audience', 'Не указано'),
+            data.get('creation_date', datetime.now().strftime('%d.%m.%Y'))
+        ])
         
         # Заголовок секции операций
         doc.add_paragraph()
         doc.add_heading('ПОСЛЕДОВАТЕЛЬНОСТЬ ОПЕРАЦИЙ', 2).alignment = WD_ALIGN_PARAGRAPH.CENTER
         
         # Парсим шаги из process_steps
-        steps_text = data.get('process_steps', '')
-        if steps_text and steps_text != 'Не указано':
-            # Разбиваем по цифрам или точкам
-            steps = []
-            if '1.' in steps_text or '2.' in steps_text:
-                # Если есть нумерация
-                steps = [step.strip() for step in re.split(r'\d+\.', steps_text) if step.strip()]
-            else:
-                # Если нет нумерации, разбиваем по предложениям
-                steps = [step.strip() for step in steps_text.split('.') if step.strip()]
-            
-            if steps:
-                ops_table = doc.add_table(rows=len(steps) + 1, cols=4)
-                ops_table.style = 'Table Grid'
-                ops_table.alignment = WD_TABLE_ALIGNMENT.CENTER
-                
-                # Заголовки таблицы
-                headers = ['№', 'Операция', 'Описание', 'Контроль']
-                for i, header in enumerate(headers):
-                    cell = ops_table.cell(0, i)
-                    cell.text = header
-                    # Жирный шрифт для заголовков
-                    for paragraph in cell.paragraphs:
-                        for run in paragraph.runs:
-                            run.font.bold = True
-                
-                # Заполнение операций
-                for i, step in enumerate(steps, 1):
-                    ops_table.cell(i, 0).text = str(i)
-                    ops_table.cell(i, 1).text = f"Этап {i}"
-                    ops_table.cell(i, 2).text = step
-                    ops_table.cell(i, 3).text = "✓"
+        steps = parse_steps(data.get('process_steps', ''))
+        if steps:
+            with metrics.stage('tables'):
+                # Заголовки жирным, затем по строке на операцию
+                rows = [['№', 'Операция', 'Описание', 'Контроль']]
+                rows.extend([str(i), f"Этап {i}", step, "✓"] for i, step in enumerate(steps, 1))
+                body = doc.element.body
+                body.sectPr.addprevious(bulk_table(
+                    rows, self._skeleton('sok').block_width, align='center', bold_header=True
+                ))
         
         # Ресурсы и инструменты
         doc.add_paragraph()
@@ -108,69 +314,18 @@ class DocumentGenerator:
         results_text = data.get('expected_results', 'Не указано')
         doc.add_paragraph(f"Результат выполнения: {results_text}")
         
-        # Согласование
-        doc.add_paragraph()
-        doc.add_heading('СОГЛАСОВАНИЕ', 2).alignment = WD_ALIGN_PARAGRAPH.CENTER
-        
-        approval_table = doc.add_table(rows=2, cols=3)
-        approval_table.style = 'Table Grid'
-        
-        # Заголовки
-        headers = ['Разработал', 'Проверил', 'Утвердил']
-        for i, header in enumerate(headers):
-            cell = approval_table.cell(0, i)
-            cell.text = header
-            for paragraph in cell.paragraphs:
-                for run in paragraph.runs:
-                    run.font.bold = True
-        
-        # Подписи
-        signatures = [
-            data.get('author', '_________________'),
-            data.get('coordinator', '_________________'),
-            data.get('approver', '_________________')
-        ]
-        
-        for i, signature in enumerate(signatures):
-            approval_table.cell(1, i).text = f"{signature}\n(подпись, дата)"
-        
-        # Подпись платформы
-        doc.add_paragraph()
-        footer = doc.add_paragraph('Создано с помощью платформы HowDo')
-        footer.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        
-        return doc
+        return self._finish_document('sok', doc, tail, data)
     
     def generate_instruction_docx(self, data):
         """Генерирует рабочую инструкцию в формате Word"""
-        doc = Document()
-        
-        # Настройка стилей
-        style = doc.styles['Normal']
-        font = style.font
-        font.name = 'Times New Roman'
-        font.size = Pt(12)
-        
-        # Заголовок
-        title = doc.add_heading('РАБОЧАЯ ИНСТРУКЦИЯ', 0)
-        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        
-        # Основная информация
-        doc.add_paragraph()
-        info_table = doc.add_table(rows=5, cols=2)
-        info_table.style = 'Table Grid'
-        
-        info_data = [
-            ('Компания:', data.get('company_name', 'Не указано')),
-            ('Процесс:', data.get('process_name', 'Не указано')),
-            ('Целевая аудитория:', data.get('target_audience', 'Не указано')),
-            ('Версия:', data.get('version', '1.0')),
-            ('Дата создания:', data.get('creation_date', datetime.now().strftime('%d.%m.%Y')))
-        ]
-        
-        for i, (label, value) in enumerate(info_data):
-            info_table.cell(i, 0).text = label
-            info_table.cell(i, 1).text = str(value)
+        data = ooxml.clean_fields(data)
+        doc, tail = self._start_document('instruction', [
+            data.get('company_name', 'Не указано'),
+            data.get('process_name', 'Не указано'),
+            data.get('target_audience', 'Не указано'),
+            data.get('version', '1.0'),
+            data.get('creation_date', datetime.now().strftime('%d.%m.%Y'))
+        ])
         
         # Цель и область применения
         doc.add_paragraph()
@@ -194,63 +349,18 @@ class DocumentGenerator:
         doc.add_heading('ОЖИДАЕМЫЕ РЕЗУЛЬТАТЫ', 2)
         doc.add_paragraph(data.get('expected_results', 'Не указано'))
         
-        # Согласование
-        doc.add_paragraph()
-        doc.add_heading('СОГЛАСОВАНИЕ', 2)
-        
-        approval_table = doc.add_table(rows=2, cols=3)
-        approval_table.style = 'Table Grid'
-        
-        headers = ['Разработал', 'Проверил', 'Утвердил']
-        for i, header in enumerate(headers):
-            approval_table.cell(0, i).text = header
-        
-        signatures = [
-            data.get('author', '_________________'),
-            data.get('coordinator', '_________________'),
-            data.get('approver', '_________________')
-        ]
-        
-        for i, signature in enumerate(signatures):
-            approval_table.cell(1, i).text = f"{signature}\n(подпись, дата)"
-        
-        # Подпись платформы
-        doc.add_paragraph()
-        footer = doc.add_paragraph('Создано с помощью платформы HowDo')
-        footer.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        
-        return doc
+        return self._finish_document('instruction', doc, tail, data)
     
     def generate_procedure_docx(self, data):
         """Генерирует стандарт процедуры в формате Word"""
-        doc = Document()
-        
-        # Настройка стилей
-        style = doc.styles['Normal']
-        font = style.font
-        font.name = 'Times New Roman'
-        font.size = Pt(12)
-        
-        # Заголовок
-        title = doc.add_heading('СТАНДАРТ ПРОЦЕДУРЫ', 0)
-        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        
-        # Основная информация
-        doc.add_paragraph()
-        info_table = doc.add_table(rows=5, cols=2)
-        info_table.style = 'Table Grid'
-        
-        info_data = [
-            ('Компания:', data.get('company_name', 'Не указано')),
-            ('Процедура:', data.get('process_name', 'Не указано')),
-            ('Ответственные:', data.get('target_audience', 'Не указано')),
-            ('Версия:', data.get('version', '1.0')),
-            ('Дата создания:', data.get('creation_date', datetime.now().strftime('%d.%m.%Y')))
-        ]
-        
-        for i, (label, value) in enumerate(info_data):
-            info_table.cell(i, 0).text = label
-            info_table.cell(i, 1).text = str(value)
+        data = ooxml.clean_fields(data)
+        doc, tail = self._start_document('procedure', [
+            data.get('company_name', 'Не указано'),
+            data.get('process_name', 'Не указано'),
+            data.get('target_audience', 'Не указано'),
+            data.get('version', '1.0'),
+            data.get('creation_date', datetime.now().strftime('%d.%m.%Y'))
+        ])
         
         # Назначение процедуры
         doc.add_paragraph()
@@ -272,36 +382,260 @@ class DocumentGenerator:
         doc.add_heading('КРИТЕРИИ КАЧЕСТВА', 2)
         doc.add_paragraph(data.get('expected_results', 'Не указано'))
         
-        # Согласование
-        doc.add_paragraph()
-        doc.add_heading('СОГЛАСОВАНИЕ', 2)
-        
-        approval_table = doc.add_table(rows=2, cols=3)
-        approval_table.style = 'Table Grid'
+        return self._finish_document('procedure', doc, tail, data)
+    
+    def generate_wizard_docx(self, answers, creation_date=None):
+        """
+        Генерирует СОК по ответам мастера (/api/wizard) для скачивания
+        Принимает answers словарь с ключами q1..q8
+        """
+        answers = ooxml.clean_fields(answers)
+        doc, _ = self._start_document('wizard', [
+            answers.get('q1', 'Не указано'),
+            answers.get('q2', 'Не указано'),
+            answers.get('q3', 'Не указано'),
+            creation_date or datetime.now().strftime('%d.%m.%Y')
+        ])
+        
+        # Заголовок СОК
+        doc.paragraphs[0].text = f"СОК: {answers.get('q2', 'Не указано')}"
+        
+        # Описание
+        doc.add_heading('Описание', level=1)
+        description = answers.get('q4', 'Стандартная процедура выполнения операции')
+        doc.add_paragraph(description)
+        
+        # Шаги выполнения
+        doc.add_heading('Шаги выполнения', level=1)
+        for i, step in enumerate(parse_list(answers.get('q5', '')), 1):
+            doc.add_paragraph(f"{i}. {step}")
+        
+        # Требования безопасности
+        doc.add_heading('Требования безопасности', level=1)
+        for requirement in parse_list(answers.get('q6', '')):
+            doc.add_paragraph(requirement, style='List Bullet')
+        
+        # Контроль качества
+        doc.add_heading('Контроль качества', level=1)
+        for check in parse_list(answers.get('q7', '')):
+            doc.add_paragraph(check, style='List Bullet')
         
-        headers = ['Разработал', 'Проверил', 'Утвердил']
-        for i, header in enumerate(headers):
-            approval_table.cell(0, i).text = header
+        # Ожидаемые результаты
+        if answers.get('q8'):
+            doc.add_heading('Ожидаемые результаты', level=1)
+            doc.add_paragraph(answers.get('q8', ''))
         
+        return doc
+    
+    # Потоковый backend: тот же документ, но XML пишется сразу в zip без python-docx
+    def _stream(self, doc_type, blocks):
+        return self._stream_writer(doc_type).stream(blocks)
+    
+    def _stream_info_table(self, doc_type, values):
+        labels = SKELETON_SPECS[doc_type]['info_labels']
+        width = self._stream_writer(doc_type).block_width
+        return ooxml.table([(label, str(value)) for label, value in zip(labels, values)], width)
+    
+    def _stream_approval(self, doc_type, data):
+        spec = SKELETON_SPECS[doc_type]
+        width = self._stream_writer(doc_type).block_width
         signatures = [
-            data.get('author', '_________________'),
-            data.get('coordinator', '_________________'),
-            data.get('approver', '_________________')
+            f"{data.get(key, '_________________')}\n(подпись, дата)"
+            for key in ('author', 'coordinator', 'approver')
         ]
-        
-        for i, signature in enumerate(signatures):
-            approval_table.cell(1, i).text = f"{signature}\n(подпись, дата)"
-        
-        # Подпись платформы
-        doc.add_paragraph()
-        footer = doc.add_paragraph('Создано с помощью платформы HowDo')
-        footer.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        
-        return doc
+        yield ooxml.paragraph()
+        yield ooxml.paragraph('СОГЛАСОВАНИЕ', 'Heading2', 'center' if spec['approval_centered'] else None)
+        col_width = width // 3
+        yield (ooxml.table_start(3, width)
+               + ooxml.table_row(APPROVAL_HEADERS, col_width, bold=spec['approval_bold'])
+               + ooxml.table_row(signatures, col_width)
+               + '</w:tbl>')
+        yield ooxml.paragraph()
+        yield ooxml.paragraph('Создано с помощью платформы HowDo', align='right')
+    
+    def _stream_sections(self, doc_type, sections):
+        """Разделы инструкции и процедуры: пустая строка, заголовок, абзацы"""
+        for title, paragraphs in sections:
+            yield ooxml.paragraph()
+            yield ooxml.heading(title, 2)
+            for text in paragraphs:
+                yield ooxml.paragraph(text)
+    
+    def _sok_blocks(self, data):
+        data = ooxml.clean_fields(data)
+        width = self._stream_writer('sok').block_width
+        yield ooxml.paragraph(SKELETON_SPECS['sok']['title'], 'Title', 'center')
+        yield ooxml.paragraph()
+        yield self._stream_info_table('sok', [
+            data.get('company_name', 'Не указано'),
+            data.get('process_name', 'Не указано'),
+            data.get('target_audience', 'Не указано'),
+            data.get('creation_date', datetime.now().strftime('%d.%m.%Y'))
+        ])
+        
+        yield ooxml.paragraph()
+        yield ooxml.paragraph('ПОСЛЕДОВАТЕЛЬНОСТЬ ОПЕРАЦИЙ', 'Heading2', 'center')
+        
+        steps = parse_steps(data.get('process_steps', ''))
+        if steps:
+            # Таблица операций отдается построчно, чтобы не держать её целиком
+            col_width = width // 4
+            yield ooxml.table_start(4, width, align='center')
+            yield ooxml.table_row(['№', 'Операция', 'Описание', 'Контроль'], col_width, bold=True)
+            for i, step in enumerate(steps, 1):
+                yield ooxml.table_row([str(i), f"Этап {i}", step, "✓"], col_width)
+            yield '</w:tbl>'
+        
+        yield ooxml.paragraph()
+        yield ooxml.paragraph('НЕОБХОДИМЫЕ РЕСУРСЫ', 'Heading2', 'center')
+        yield ooxml.paragraph(f"Инструменты и материалы: {data.get('required_resources', 'Не указано')}")
+        
+        yield ooxml.paragraph()
+        yield ooxml.paragraph('ОЖИДАЕМЫЕ РЕЗУЛЬТАТЫ', 'Heading2', 'center')
+        yield ooxml.paragraph(f"Результат выполнения: {data.get('expected_results', 'Не указано')}")
+        
+        yield from self._stream_approval('sok', data)
+    
+    def _instruction_blocks(self, data):
+        data = ooxml.clean_fields(data)
+        yield ooxml.paragraph(SKELETON_SPECS['instruction']['title'], 'Title', 'center')
+        yield ooxml.paragraph()
+        yield self._stream_info_table('instruction', [
+            data.get('company_name', 'Не указано'),
+            data.get('process_name', 'Не указано'),
+            data.get('target_audience', 'Не указано'),
+            data.get('version', '1.0'),
+            data.get('creation_date', datetime.now().strftime('%d.%m.%Y'))
+        ])
+        yield from self._stream_sections('instruction', [
+            ('ЦЕЛЬ И ОБЛАСТЬ ПРИМЕНЕНИЯ', [
+                f"Сфера деятельности: {data.get('business_area', 'Не указано')}",
+                f"Процесс: {data.get('process_name', 'Не указано')}"
+            ]),
+            ('ПОШАГОВЫЕ ИНСТРУКЦИИ', [data.get('process_steps', 'Не указано')]),
+            ('НЕОБХОДИМЫЕ РЕСУРСЫ', [data.get('required_resources', 'Не указано')]),
+            ('ОЖИДАЕМЫЕ РЕЗУЛЬТАТЫ', [data.get('expected_results', 'Не указано')])
+        ])
+        yield from self._stream_approval('instruction', data)
+    
+    def _procedure_blocks(self, data):
+        data = ooxml.clean_fields(data)
+        yield ooxml.paragraph(SKELETON_SPECS['procedure']['title'], 'Title', 'center')
+        yield ooxml.paragraph()
+        yield self._stream_info_table('procedure', [
+            data.get('company_name', 'Не указано'),
+            data.get('process_name', 'Не указано'),
+            data.get('target_audience', 'Не указано'),
+            data.get('version', '1.0'),
+            data.get('creation_date', datetime.now().strftime('%d.%m.%Y'))
+        ])
+        yield from self._stream_sections('procedure', [
+            ('НАЗНАЧЕНИЕ ПРОЦЕДУРЫ', [f"Область применения: {data.get('business_area', 'Не указано')}"]),
+            ('ОПИСАНИЕ ПРОЦЕДУРЫ', [data.get('process_steps', 'Не указано')]),
+            ('НЕОБХОДИМЫЕ РЕСУРСЫ', [data.get('required_resources', 'Не указано')]),
+            ('КРИТЕРИИ КАЧЕСТВА', [data.get('expected_results', 'Не указано')])
+        ])
+        yield from self._stream_approval('procedure', data)
+    
+    def _wizard_title(self, values):
+        yield ooxml.heading(f"СОК: {values.get('q2', 'Не указано')}", 0)
+    
+    def _wizard_info(self, values):
+        yield ooxml.heading(SKELETON_SPECS['wizard']['info_heading'], 1)
+        yield self._stream_info_table('wizard', [
+            values.get('q1', 'Не указано'),
+            values.get('q2', 'Не указано'),
+            values.get('q3', 'Не указано'),
+            values['creation_date']
+        ])
+    
+    def _wizard_description(self, values):
+        yield ooxml.heading('Описание', 1)
+        yield ooxml.paragraph(values.get('q4', 'Стандартная процедура выполнения операции'))
+    
+    def _wizard_steps(self, values):
+        yield ooxml.heading('Шаги выполнения', 1)
+        for i, step in enumerate(parse_list(values.get('q5', '')), 1):
+            yield ooxml.paragraph(f"{i}. {step}")
+    
+    def _wizard_safety(self, values):
+        yield ooxml.heading('Требования безопасности', 1)
+        for requirement in parse_list(values.get('q6', '')):
+            yield ooxml.paragraph(requirement, 'ListBullet')
+    
+    def _wizard_quality(self, values):
+        yield ooxml.heading('Контроль качества', 1)
+        for check in parse_list(values.get('q7', '')):
+            yield ooxml.paragraph(check, 'ListBullet')
+    
+    def _wizard_results(self, values):
+        if values.get('q8'):
+            yield ooxml.heading('Ожидаемые результаты', 1)
+            yield ooxml.paragraph(values.get('q8', ''))
+    
+    def _wizard_blocks(self, answers, creation_date):
+        values = dict(
+            ooxml.clean_fields(answers), creation_date=creation_date or datetime.now().strftime('%d.%m.%Y')
+        )
+        for name, fields in WIZARD_SECTIONS:
+            build = getattr(self, f'_wizard_{name}')
+            if self.fragment_cache is None:
+                yield from build(values)
+                continue
+            # Ключ раздела - только его поля, поэтому правка q5 не трогает остальные разделы.
+            # Флаг наличия отделяет отсутствующий ответ от null
+            key = RenderCache.make_key(
+                {"section": name, "values": [[field in values, values.get(field)] for field in fields]},
+                GENERATOR_VERSION
+            )
+            fragment = self.fragment_cache.get(key)
+            if fragment is None:
+                fragment = ''.join(build(values)).encode('utf-8')
+                self.fragment_cache.put(key, fragment)
+            yield fragment
+    
+    def stream_sok_docx(self, data):
+        """Потоковая версия generate_sok_docx: генератор байтов готового .docx"""
+        return self._stream('sok', self._sok_blocks(data))
+    
+    def stream_instruction_docx(self, data):
+        """Потоковая версия generate_instruction_docx"""
+        return self._stream('instruction', self._instruction_blocks(data))
+    
+    def stream_procedure_docx(self, data):
+        """Потоковая версия generate_procedure_docx"""
+        return self._stream('procedure', self._procedure_blocks(data))
+    
+    def stream_wizard_docx(self, answers, creation_date=None):
+        """Потоковая версия generate_wizard_docx"""
+        return self._stream('wizard', self._wizard_blocks(answers, creation_date))
+    
+    def render_wizard_bytes(self, answers, creation_date=None, backend='python-docx'):
+        """Готовый .docx по ответам мастера в виде байтов выбранным backend"""
+        if backend == 'stream':
+            return b''.join(self.stream_wizard_docx(answers, creation_date))
+        doc = self.generate_wizard_docx(answers, creation_date)
+        file_stream = io.BytesIO()
+        with metrics.stage('save'):
+            doc.save(file_stream)
+        return file_stream.getvalue()
+    
+    def render_wizard_pdf(self, answers, creation_date=None):
+        """PDF по ответам мастера на основе sok_template.html"""
+        context = wizard_sok_context(answers, creation_date or datetime.now().strftime('%d.%m.%Y'))
+        return self.pdf_renderer.render(self.template_mapping['sok'], context)
+    
+    def render_wizard_html(self, answers, creation_date=None):
+        """HTML-предпросмотр по ответам мастера на основе sok_template.html"""
+        context = wizard_sok_context(answers, creation_date or datetime.now().strftime('%d.%m.%Y'))
+        return self.html_renderer.render(self.template_mapping['sok'], context)
     
     # HTML методы для предварительного просмотра (упрощенные версии)
     def generate_sok_html(self, data):
         """Генерирует HTML для предварительного просмотра СОК"""
+        return self._simple_html(data, 'СТАНДАРТНАЯ ОПЕРАЦИОННАЯ КАРТА (СОК)')
+    
+    def _simple_html(self, data, heading):
         html = f"""
         <html>
         <head>
@@ -316,7 +650,7 @@ class DocumentGenerator:
             </style>
         </head>
         <body>
-            <h1>СТАНДАРТНАЯ ОПЕРАЦИОННАЯ КАРТА (СОК)</h1>
+            <h1>{heading}</h1>
             
             <table>
                 <tr><td><strong>Компания:</strong></td><td>{data.get('company_name', 'Не указано')}</td></tr>
@@ -342,9 +676,9 @@ class DocumentGenerator:
     
     def generate_instruction_html(self, data):
         """Генерирует HTML для предварительного просмотра инструкции"""
-        return self.generate_sok_html(data).replace('СТАНДАРТНАЯ ОПЕРАЦИОННАЯ КАРТА (СОК)', 'РАБОЧАЯ ИНСТРУКЦИЯ')
+        return self._simple_html(data, 'РАБОЧАЯ ИНСТРУКЦИЯ')
     
     def generate_procedure_html(self, data):
         """Генерирует HTML для предварительного просмотра процедуры"""
-        return self.generate_sok_html(data).replace('СТАНДАРТНАЯ ОПЕРАЦИОННАЯ КАРТА (СОК)', 'СТАНДАРТ ПРОЦЕДУРЫ')
+        return self._simple_html(data, 'СТАНДАРТ ПРОЦЕДУРЫ')
 
@@ -0,0 +1,231 @@
+"""
+Потоковая запись .docx без построения дерева python-docx
+word/document.xml сжимается и отдается по частям, остальные части пакета
+(стили, настройки, типы содержимого) сжимаются один раз и переиспользуются
+"""
+
+import io
+import re
+import struct
+import time
+import zipfile
+import zlib
+from xml.sax.saxutils import escape
+
+from metrics import metrics
+
+DOCUMENT_PART = 'word/document.xml'
+
+# Оформление таблиц такое же, как у python-docx (стиль Table Grid)
+TABLE_LOOK = ('<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" '
+              'w:lastRow="0" w:noHBand="0" w:noVBand="1" w:val="04A0"/>')
+
+
+# Символы, недопустимые в XML 1.0. Вертикальную табуляцию Word вставляет как мягкий перенос строки
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+# Как в python-docx: табуляция - w:tab, перевод строки и возврат каретки - w:br
+RUN_BREAKS = re.compile(r'([\t\r\n])')
+RUN_BREAK_XML = {'\t': '<w:tab/>', '\r': '<w:br/>', '\n': '<w:br/>'}
+
+
+def clean_text(text):
+    """Текст, который можно записать в XML: мягкий перенос - \\n, прочие управляющие символы удаляются"""
+    return INVALID_XML_CHARS.sub('', str(text).replace('\x0b', '\n'))
+
+
+def clean_fields(data):
+    """Копия словаря ответов с очищенными строковыми значениями (для обоих backend)"""
+    return {key: clean_text(value) if isinstance(value, str) else value for key, value in data.items()}
+
+
+def _text_runs(text, bold=False):
+    if text is None or text == '':
+        return ''
+    rpr = '<w:rPr><w:b/></w:rPr>' if bold else ''
+    parts = []
+    for piece in RUN_BREAKS.split(clean_text(text)):
+        if piece in RUN_BREAK_XML:
+            parts.append(RUN_BREAK_XML[piece])
+        elif piece:
+            space = ' xml:space="preserve"' if piece != piece.strip() else ''
+            parts.append(f'<w:t{space}>{escape(piece)}</w:t>')
+    if not parts:
+        return ''
+    return f'<w:r>{rpr}{"".join(parts)}</w:r>'
+
+
+def paragraph(text='', style=None, align=None, bold=False):
+    """XML абзаца: style - id стиля (Title, Heading2, ListBullet), align - center/right"""
+    ppr = ''
+    if style or align:
+        ppr = '<w:pPr>'
+        if style:
+            ppr += f'<w:pStyle w:val="{style}"/>'
+        if align:
+            ppr += f'<w:jc w:val="{align}"/>'
+        ppr += '</w:pPr>'
+    runs = _text_runs(text, bold)
+    if not ppr and not runs:
+        return '<w:p/>'
+    return f'<w:p>{ppr}{runs}</w:p>'
+
+
+def heading(text, level):
+    style = 'Title' if level == 0 else f'Heading{level}'
+    return paragraph(text, style=style)
+
+
+def table_start(col_count, block_width, align=None):
+    # Ширина колонок как у python-docx: ширина текста / число колонок
+    width = block_width // col_count
+    jc = f'<w:jc w:val="{align}"/>' if align else ''
+    grid = ''.join(f'<w:gridCol w:w="{width}"/>' for _ in range(col_count))
+    return (f'<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:type="auto" w:w="0"/>'
+            f'{jc}{TABLE_LOOK}</w:tblPr><w:tblGrid>{grid}</w:tblGrid>')
+
+
+def table_row(cells, col_width, bold=False):
+    tc = ''.join(
+        f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{col_width}"/></w:tcPr>'
+        f'<w:p>{_text_runs(cell, bold)}</w:p></w:tc>'
+        for cell in cells
+    )
+    return f'<w:tr>{tc}</w:tr>'
+
+
+def table(rows, block_width, align=None, bold_header=False):
+    """XML таблицы целиком; для больших таблиц строки лучше отдавать через table_row"""
+    col_count = len(rows[0])
+    width = block_width // col_count
+    parts = [table_start(col_count, block_width, align)]
+    for i, row in enumerate(rows):
+        parts.append(table_row(row, width, bold=bold_header and i == 0))
+    parts.append('</w:tbl>')
+    return ''.join(parts)
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class StreamingDocxWriter:
+    """
+    Пишет zip-контейнер .docx напрямую в поток байтов.
+    Статичные части берутся из готового пакета (заготовки документа)
+    и хранятся уже сжатыми вместе с CRC
+    """
+    def __init__(self, package_bytes, block_width, compress_level=6):
+        self.block_width = block_width
+        self.compress_level = compress_level
+        # Порядок частей сохраняется; вместо document.xml стоит None
+        self._parts = []
+        with zipfile.ZipFile(io.BytesIO(package_bytes)) as package:
+            for info in package.infolist():
+                data = package.read(info.filename)
+                if info.filename == DOCUMENT_PART:
+                    self._split_document(data)
+                    self._parts.append(None)
+                    continue
+                compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+                compressed = compressor.compress(data) + compressor.flush()
+                self._parts.append((info.filename, compressed, zlib.crc32(data), len(data)))
+
+    def _split_document(self, data):
+        # Пролог с пространствами имен и sectPr переиспользуются как есть
+        body_start = data.index(b'<w:body>') + len(b'<w:body>')
+        sect_start = data.rindex(b'<w:sectPr')
+        self._document_head = data[:body_start]
+        self._document_tail = data[sect_start:]
+
+    def stream(self, blocks, chunk_size=64 * 1024):
+        """
+        Генератор байтов .docx: blocks - итерируемые XML-фрагменты тела документа (str или bytes).
+        В памяти одновременно держится только текущая порция сжатых данных
+        """
+        dos_time, dos_date = _dos_datetime(time.time())
+        offset = 0
+        directory = []
+
+        def record(name, flags, crc, compressed_size, size, header_offset):
+            directory.append(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, flags, zipfile.ZIP_DEFLATED,
+                dos_time, dos_date, crc, compressed_size, size,
+                len(name), 0, 0, 0, 0, 0, header_offset
+            ) + name)
+
+        for part in self._parts:
+            if part is None:
+                # document.xml: размеры и CRC неизвестны заранее, пишутся в data descriptor
+                name = DOCUMENT_PART.encode('utf-8')
+                header = struct.pack(
+                    '<IHHHHHIIIHH', 0x04034b50, 20, 0x08, zipfile.ZIP_DEFLATED,
+                    dos_time, dos_date, 0, 0, 0, len(name), 0
+                ) + name
+                yield header
+                written = 0
+                stats = {}
+                for chunk in self._stream_document(blocks, stats, chunk_size):
+                    written += len(chunk)
+                    yield chunk
+                descriptor = struct.pack('<IIII', 0x08074b50, stats['crc'], written, stats['size'])
+                yield descriptor
+                record(name, 0x08, stats['crc'], written, stats['size'], offset)
+                offset += len(header) + written + len(descriptor)
+                continue
+
+            filename, compressed, crc, size = part
+            name = filename.encode('utf-8')
+            header = struct.pack(
+                '<IHHHHHIIIHH', 0x04034b50, 20, 0, zipfile.ZIP_DEFLATED,
+                dos_time, dos_date, crc, len(compressed), size, len(name), 0
+            ) + name
+            yield header + compressed
+            record(name, 0, crc, len(compressed), size, offset)
+            offset += len(header) + len(compressed)
+
+        # Центральный каталог
+        directory = b''.join(directory)
+        yield directory + struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, len(self._parts), len(self._parts),
+            len(directory), offset, 0
+        )
+
+    def _stream_document(self, blocks, stats, chunk_size):
+        compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, -15)
+        crc = 0
+        size = 0
+        pending = []
+        pending_size = 0
+        # Время сжатия копится отдельно от построения XML блоков
+        zip_seconds = 0.0
+
+        for data in self._iter_document(blocks):
+            start = time.perf_counter()
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            compressed = compressor.compress(data)
+            zip_seconds += time.perf_counter() - start
+            if compressed:
+                pending.append(compressed)
+                pending_size += len(compressed)
+            if pending_size >= chunk_size:
+                yield b''.join(pending)
+                pending = []
+                pending_size = 0
+
+        start = time.perf_counter()
+        pending.append(compressor.flush())
+        metrics.observe_stage('zip', zip_seconds + time.perf_counter() - start)
+        stats['crc'] = crc
+        stats['size'] = size
+        yield b''.join(pending)
+
+    def _iter_document(self, blocks):
+        yield self._document_head
+        for block in blocks:
+            # Готовые фрагменты из кэша приходят уже в байтах
+            yield block if isinstance(block, bytes) else block.encode('utf-8')
+        yield self._document_tail
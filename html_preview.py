@@ -0,0 +1,60 @@
+"""
+HTML-предпросмотр по шаблонам из templates/
+Статичные начало и конец шаблона кэшируются готовыми строками,
+на каждый запрос рендерится только динамическая середина
+"""
+
+import gzip
+import threading
+
+from templating import BODY_SUFFIX, split_static
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class HtmlPreviewRenderer:
+    def __init__(self, environment):
+        self.environment = environment
+        self._fragments = {}
+        self._lock = threading.Lock()
+
+    def _fragments_for(self, name):
+        fragments = self._fragments.get(name)
+        if fragments is None:
+            with self._lock:
+                fragments = self._fragments.get(name)
+                if fragments is None:
+                    source, _, _ = self.environment.loader.get_source(self.environment, name)
+                    header, _, footer = split_static(source)
+                    body = self.environment.get_template(name + BODY_SUFFIX)
+                    fragments = (header, body, footer)
+                    self._fragments[name] = fragments
+        return fragments
+
+    def warm_up(self, names):
+        for name in names:
+            self._fragments_for(name)
+
+    def render(self, template_name, context):
+        header, body, footer = self._fragments_for(template_name)
+        return header + body.render(**context) + footer
+
+
+def negotiate_encoding(accept_encoding):
+    """Лучшее поддерживаемое сжатие из заголовка Accept-Encoding (werkzeug MIMEAccept)"""
+    if brotli is not None and accept_encoding['br']:
+        return 'br'
+    if accept_encoding['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    return data
@@ -0,0 +1,85 @@
+"""
+Отчет о времени импорта приложения (python -X importtime) с проверкой бюджета
+Каждый запуск - новый интерпретатор, то есть холодный старт воркера. Код возврата 1,
+если импорт дольше бюджета или при старте загрузился стек рендера:
+
+    python importtime_report.py --budget-ms 500
+
+Та же проверка входит в тесты: tests/test_import_time.py
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Модули, которые должны загружаться только при первом рендере (или в preload)
+LAZY_MODULES = ('docx', 'lxml', 'weasyprint', 'pdfkit', 'multiprocessing')
+
+
+def default_budget_ms():
+    return float(os.environ.get('HOWDO_IMPORT_BUDGET_MS', 500))
+
+
+def measure(module):
+    """(время импорта module в мкс, {модуль: (собственное, накопленное)}) одного холодного старта"""
+    env = dict(os.environ)
+    env.pop('HOWDO_PRELOAD', None)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules[module][1], modules
+
+
+def best_of(module, runs):
+    """Самый быстрый из runs холодных стартов: (мкс, модули)"""
+    return min((measure(module) for _ in range(runs)), key=lambda run: run[0])
+
+
+def eager_modules(modules):
+    """Модули из LAZY_MODULES (и их подмодули), загруженные при старте"""
+    return sorted(
+        name for name in modules
+        if any(name == lazy or name.startswith(lazy + '.') for lazy in LAZY_MODULES)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--budget-ms', type=float, default=default_budget_ms())
+    parser.add_argument('--runs', type=int, default=3, help='берется лучший из запусков')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    total, modules = best_of(args.module, args.runs)
+
+    print(f"Импорт {args.module}: {total / 1000:.1f} мс (бюджет {args.budget_ms:.0f} мс)")
+    print(f"{'накопл., мс':>12} {'собств., мс':>12}  модуль")
+    for name, (self_us, cumulative_us) in sorted(modules.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"{cumulative_us / 1000:>12.1f} {self_us / 1000:>12.1f}  {name}")
+
+    eager = eager_modules(modules)
+    failed = False
+    if eager:
+        print(f"Загружены при старте, хотя должны грузиться лениво: {', '.join(eager)}")
+        failed = True
+    if total / 1000 > args.budget_ms:
+        print("Бюджет холодного старта превышен")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
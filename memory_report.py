@@ -0,0 +1,91 @@
+"""
+Отчет о памяти на документ в MemoryStorage
+Загружает N синтетических документов с типичными повторами (одни и те же компании,
+исполнители, требования безопасности) в прежнее представление (словарь на документ)
+и в DocumentRecord, и печатает байты на документ по tracemalloc:
+
+    python memory_report.py --documents 20000
+"""
+
+import argparse
+import json
+import random
+import tracemalloc
+import uuid
+from bisect import insort
+from datetime import datetime, timedelta
+
+from storage import MemoryStorage
+
+COMPANIES = [f'ООО «Завод №{i}»' for i in range(50)]
+PERFORMERS = ['Слесарь-сборщик 4 разряда', 'Оператор станка с ЧПУ', 'Сварщик', 'Контролер ОТК', 'Мастер участка']
+SAFETY = [
+    'Работать в защитных очках\nИспользовать перчатки\nПроверить заземление',
+    'Работать в спецодежде\nНе допускать посторонних в зону работ',
+    'Использовать средства индивидуальной защиты\nПроверить исправность инструмента'
+]
+QUALITY = ['Визуальный контроль\nКонтроль момента затяжки', 'Проверка калибром\nЗапись в журнал']
+
+
+def synthetic_payloads(count, seed=0):
+    """JSON-тела /api/wizard: строки каждого документа - отдельные объекты, как после разбора запроса"""
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    for i in range(count):
+        answers = {
+            'q1': rng.choice(COMPANIES),
+            'q2': f'Операция {rng.randrange(500)}',
+            'q3': rng.choice(PERFORMERS),
+            'q4': 'Стандартная процедура выполнения операции',
+            'q5': '\n'.join(f'Шаг {n}: {rng.randrange(10 ** 6)}' for n in range(1, rng.randrange(3, 12))),
+            'q6': rng.choice(SAFETY),
+            'q7': rng.choice(QUALITY),
+            'q8': 'Операция выполнена без дефектов'
+        }
+        yield json.dumps({
+            "id": str(uuid.uuid4()),
+            "user_id": f'user-{rng.randrange(count // 20 + 1)}',
+            "title": answers['q2'],
+            "answers": answers,
+            "created_at": (start + timedelta(seconds=i, microseconds=rng.randrange(10 ** 6))).isoformat()
+        }, ensure_ascii=False)
+
+
+class DictStorage:
+    """Прежнее представление: словарь документа как есть и индекс по ISO-строкам"""
+    def __init__(self):
+        self.documents = {}
+        self._by_user = {}
+
+    def add_document(self, document):
+        self.documents[document["id"]] = document
+        insort(self._by_user.setdefault(document["user_id"], []), (document["created_at"], document["id"]))
+
+
+def bytes_per_document(storage, payloads):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for payload in payloads:
+        storage.add_document(json.loads(payload))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return total / len(payloads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=20000)
+    args = parser.parse_args()
+
+    payloads = list(synthetic_payloads(args.documents))
+    before = bytes_per_document(DictStorage(), payloads)
+    after = bytes_per_document(MemoryStorage(), payloads)
+
+    print(f"Документов: {args.documents}")
+    print(f"Словарь на документ:  {before:8.0f} байт/документ")
+    print(f"DocumentRecord:       {after:8.0f} байт/документ ({after / before:.0%})")
+
+
+if __name__ == '__main__':
+    main()
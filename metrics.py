@@ -0,0 +1,272 @@
+"""
+Метрики приложения в текстовом формате Prometheus
+Гистограммы задержек по маршрутам, время этапов рендера, запросы в работе,
+отданные байты и пик потребляемой памяти процесса
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0)
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, **labels):
+        prefix = _labels(**labels)
+        prefix = prefix + ',' if prefix else ''
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}'
+        yield f'{name}_sum{{{_labels(**labels)}}} {_number(self.sum)}'
+        yield f'{name}_count{{{_labels(**labels)}}} {self.count}'
+
+
+class Metrics:
+    def __init__(self):
+        self.in_flight = 0
+        self._requests = Counter()    # (route, method, status) -> число запросов
+        self._latency = {}            # (route, method) -> Histogram
+        self._bytes_sent = Counter()  # route -> байты тела ответа
+        self._stages = {}             # этап рендера -> Histogram
+        # RLock: конец запроса может прийти из сборщика мусора в том же потоке
+        self._lock = threading.RLock()
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, route, method, status, seconds, sent):
+        with self._lock:
+            self.in_flight -= 1
+            self._requests[(route, method, status)] += 1
+            histogram = self._latency.get((route, method))
+            if histogram is None:
+                histogram = self._latency[(route, method)] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            self._bytes_sent[route] += sent
+
+    def observe_stage(self, name, seconds):
+        with self._lock:
+            histogram = self._stages.get(name)
+            if histogram is None:
+                histogram = self._stages[name] = Histogram(STAGE_BUCKETS)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        """Замер этапа рендера: with metrics.stage('save'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(name, time.perf_counter() - start)
+
+    @staticmethod
+    def memory_high_water():
+        """Пиковый RSS процесса в байтах (None, если платформа не сообщает)"""
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux сообщает килобайты, macOS - байты
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus 0.0.4"""
+        with self._lock:
+            lines = [
+                '# HELP howdo_requests_total Обработанные HTTP-запросы',
+                '# TYPE howdo_requests_total counter'
+            ]
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append(f'howdo_requests_total{{{_labels(route=route, method=method, status=status)}}} {count}')
+
+            lines += [
+                '# HELP howdo_request_duration_seconds Время обработки запроса, включая отправку тела',
+                '# TYPE howdo_request_duration_seconds histogram'
+            ]
+            for (route, method), histogram in sorted(self._latency.items()):
+                lines.extend(histogram.lines('howdo_request_duration_seconds', route=route, method=method))
+
+            lines += [
+                '# HELP howdo_response_bytes_total Отданные байты тела ответа',
+                '# TYPE howdo_response_bytes_total counter'
+            ]
+            for route, sent in sorted(self._bytes_sent.items()):
+                lines.append(f'howdo_response_bytes_total{{{_labels(route=route)}}} {sent}')
+
+            lines += [
+                '# HELP howdo_render_stage_seconds Время этапов рендера документа',
+                '# TYPE howdo_render_stage_seconds histogram'
+            ]
+            for name, histogram in sorted(self._stages.items()):
+                lines.extend(histogram.lines('howdo_render_stage_seconds', stage=name))
+
+            lines += [
+                '# HELP howdo_requests_in_flight Запросы в обработке',
+                '# TYPE howdo_requests_in_flight gauge',
+                f'howdo_requests_in_flight {self.in_flight}'
+            ]
+
+        peak = self.memory_high_water()
+        if peak is not None:
+            lines += [
+                '# HELP howdo_process_max_rss_bytes Пиковый объем резидентной памяти процесса',
+                '# TYPE howdo_process_max_rss_bytes gauge',
+                f'howdo_process_max_rss_bytes {peak}'
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+class SlowRequestProfiler:
+    """
+    Сэмплирующий профилировщик медленных запросов.
+    Пока запрос в работе, фоновый поток раз в interval снимает стек его потока;
+    если запрос шел дольше threshold секунд, стеки пишутся в output_dir
+    в свернутом формате (flamegraph.pl, speedscope)
+    """
+    def __init__(self, threshold, output_dir, interval=0.005):
+        self.threshold = threshold
+        self.output_dir = output_dir
+        self.interval = interval
+        self.dumped = 0
+        self._active = {}  # токен запроса -> (id потока, Counter стеков)
+        # RLock: stop() может вызваться сборщиком мусора (закрытие тела ответа),
+        # пока этот же поток держит блокировку
+        self._lock = threading.RLock()
+        self._thread = None
+
+    def start(self):
+        """Начинает сбор стеков текущего потока; токен передается в stop()"""
+        token = object()
+        with self._lock:
+            self._active[token] = (threading.get_ident(), Counter())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='slow-request-profiler', daemon=True)
+                self._thread.start()
+        return token
+
+    def stop(self, token, label, seconds):
+        with self._lock:
+            entry = self._active.pop(token, None)
+        if entry is not None and entry[1] and seconds >= self.threshold:
+            self._dump(label, seconds, entry[1])
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in list(self._active.values()):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[self._stack(frame)] += 1
+
+    @staticmethod
+    def _stack(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _dump(self, label, seconds, samples):
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = re.sub(r'[^\w.-]+', '_', label).strip('_') or 'request'
+        path = os.path.join(
+            self.output_dir,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{int(seconds * 1000)}ms-{name}.folded"
+        )
+        with open(path, 'w', encoding='utf-8') as output:
+            for stack, count in samples.most_common():
+                output.write(f'{stack} {count}\n')
+        self.dumped += 1
+
+
+class MetricsMiddleware:
+    """
+    WSGI-обертка: время запроса считается до отдачи последнего байта,
+    поэтому потоковые ответы (zip, .docx) учитываются целиком.
+    Шаблон маршрута кладется в environ['howdo.route'] хуком приложения
+    """
+    def __init__(self, app, metrics, profiler=None):
+        self.app = app
+        self.metrics = metrics
+        self.profiler = profiler
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        status = {}
+
+        def capture(status_line, headers, exc_info=None):
+            status['code'] = status_line.split(' ', 1)[0]
+            return start_response(status_line, headers, exc_info)
+
+        self.metrics.request_started()
+        token = self.profiler.start() if self.profiler is not None else None
+        try:
+            body = self.app(environ, capture)
+        except Exception:
+            self._finish(environ, '500', start, 0, token)
+            raise
+        return self._iterate(environ, body, status, start, token)
+
+    def _iterate(self, environ, body, status, start, token):
+        sent = 0
+        try:
+            for chunk in body:
+                sent += len(chunk)
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            self._finish(environ, status.get('code', '500'), start, sent, token)
+
+    def _finish(self, environ, status, start, sent, token):
+        seconds = time.perf_counter() - start
+        route = environ.get('howdo.route', 'unmatched')
+        method = environ.get('REQUEST_METHOD', 'GET')
+        self.metrics.request_finished(route, method, status, seconds, sent)
+        if token is not None:
+            self.profiler.stop(token, f'{method} {route}', seconds)
+
+
+# Общий реестр процесса: этапы рендера пишутся сюда из генератора
+metrics = Metrics()
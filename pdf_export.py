@@ -0,0 +1,69 @@
+"""
+Экспорт в PDF через WeasyPrint по HTML-шаблонам
+Холодный старт WeasyPrint дорогой, поэтому шаблоны, разобранный CSS и шрифты
+готовятся один раз и переиспользуются между рендерами
+"""
+
+import re
+import threading
+
+# Дополнительные правила только для печати
+PAGE_CSS = "@page { size: A4; margin: 15mm; }"
+
+STYLE_BLOCK = re.compile(r'<style[^>]*>(.*?)</style>', re.S | re.I)
+
+
+class PdfUnavailable(Exception):
+    """WeasyPrint или его системные библиотеки (pango, cairo) не установлены"""
+
+
+class PdfRenderer:
+    def __init__(self, environment):
+        self.environment = environment
+        self._weasyprint = None
+        self._font_config = None
+        self._page_css = None
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def _load_weasyprint(self):
+        # Импорт weasyprint тянет pango/cairo и занимает заметное время,
+        # поэтому выполняется при первом PDF, а не при старте приложения
+        if self._weasyprint is None:
+            try:
+                import weasyprint
+                from weasyprint.text.fonts import FontConfiguration
+            except (ImportError, OSError) as error:
+                raise PdfUnavailable(str(error))
+            self._font_config = FontConfiguration()
+            self._page_css = weasyprint.CSS(string=PAGE_CSS, font_config=self._font_config)
+            self._weasyprint = weasyprint
+        return self._weasyprint
+
+    def _template(self, name):
+        """Шаблон без блока <style> и его CSS, разобранный один раз"""
+        cached = self._templates.get(name)
+        if cached is None:
+            with self._lock:
+                cached = self._templates.get(name)
+                if cached is None:
+                    weasyprint = self._load_weasyprint()
+                    source, _, _ = self.environment.loader.get_source(self.environment, name)
+                    css = '\n'.join(STYLE_BLOCK.findall(source))
+                    template = self.environment.from_string(STYLE_BLOCK.sub('', source))
+                    stylesheet = weasyprint.CSS(string=css, font_config=self._font_config)
+                    cached = (template, stylesheet)
+                    self._templates[name] = cached
+        return cached
+
+    def warm_up(self, names):
+        for name in names:
+            self._template(name)
+
+    def render(self, template_name, context):
+        template, stylesheet = self._template(template_name)
+        html = self._weasyprint.HTML(string=template.render(**context))
+        return html.write_pdf(
+            stylesheets=[stylesheet, self._page_css],
+            font_config=self._font_config
+        )
@@ -0,0 +1,47 @@
+"""
+Ограничение частоты запросов к рендеру
+Маркерное ведро на ключ (пользователь или IP): запас burst запросов пополняется
+со скоростью rate в секунду. Обычный пользователь в запас не упирается, а поток
+повторных рендеров получает 429 с Retry-After вместо очереди на CPU
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.limited = 0
+        self._buckets = OrderedDict()  # ключ -> (маркеры, время пополнения)
+        self._lock = threading.Lock()
+
+    def acquire(self, key, cost=1):
+        """0, если запрос пропущен, иначе секунды до появления нужного числа маркеров"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost - tokens) / self.rate
+                self.limited += 1
+            self._buckets[key] = (tokens, now)
+            # Давно не приходившие ключи вытесняются: их ведра к этому времени полны
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": len(self._buckets),
+                "rate": self.rate,
+                "burst": self.burst,
+                "limited": self.limited
+            }
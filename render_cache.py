@@ -0,0 +1,156 @@
+"""
+Кэш готовых документов в памяти
+Ключ - хэш входных данных и версии генератора, вытеснение LRU в пределах бюджета по байтам.
+SingleFlight склеивает одновременные промахи кэша по одному ключу в один рендер
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+class RenderCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(payload, version):
+        """Стабильный ключ по содержимому: одинаковые данные дают одинаковый ключ"""
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(f"{version}:{raw}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key):
+        """Как get, но без счета попаданий и промахов: повторная проверка после get()"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, data, size=None):
+        """size - занимаемая память, если len(data) ее не отражает (не байты)"""
+        if size is None:
+            size = len(data)
+        # Документ больше всего бюджета не кэшируем, чтобы не вытеснить всё остальное
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (data, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Одновременные запросы одного ключа ждут рендер, который уже идет, и получают
+    его байты. Если ведущий ничего не отдал (результат None) или ждать пришлось
+    дольше wait_timeout, запрос рендерит сам
+    """
+    def __init__(self, wait_timeout=None):
+        self.wait_timeout = wait_timeout
+        self.led = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def lead(self, key):
+        """Флайт для ведущего или None, если ключ уже рендерится; завершается через finish()"""
+        with self._lock:
+            if key in self._flights:
+                return None
+            flight = self._flights[key] = _Flight()
+            self.led += 1
+            return flight
+
+    def finish(self, key, flight, result=None, error=None):
+        """Отдает результат ждущим; повторный вызов для того же флайта ничего не делает"""
+        if flight.done.is_set():
+            return
+        flight.result = result
+        flight.error = error
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.done.set()
+
+    def do(self, key, render):
+        """Результат render() для key; одновременные вызовы с тем же key выполняют его один раз"""
+        while True:
+            flight = self.lead(key)
+            if flight is not None:
+                try:
+                    result = render()
+                except BaseException as error:
+                    self.finish(key, flight, error=error)
+                    raise
+                self.finish(key, flight, result)
+                return result
+
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    continue
+                self.coalesced += 1
+            if not flight.done.wait(self.wait_timeout):
+                return render()
+            if flight.error is not None:
+                raise flight.error
+            if flight.result is not None:
+                return flight.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "led": self.led,
+                "coalesced": self.coalesced
+            }
@@ -0,0 +1,114 @@
+"""
+Фоновые задачи рендера
+Мастер (или явный запрос) ставит рендер в локальную очередь и получает id задачи,
+клиент опрашивает статус и затем забирает готовый файл.
+render(document_id) возвращает (ключ кэша, байты): ключ - версия ответов, по которой шел рендер.
+Байты задача не хранит - они лежат в кэше готовых документов с ограничением по объему
+"""
+
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from render_pool import RenderQueueFull
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class RenderJob:
+    def __init__(self, document_id):
+        self.id = str(uuid.uuid4())
+        self.document_id = document_id
+        self.status = QUEUED
+        self.error = None
+        self.cache_key = None
+        self.size = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "document_id": self.document_id,
+            "status": self.status,
+            "error": self.error,
+            "size": self.size
+        }
+
+
+class JobQueue:
+    def __init__(self, render, workers=2, max_pending=100, max_jobs=1000, retry_after=1):
+        self.render = render
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.retry_after = retry_after
+        self.completed = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start(self):
+        # Потоки запускаются при первой задаче, а не при импорте приложения
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"render-job-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, document_id):
+        self._start()
+        job = RenderJob(document_id)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise RenderQueueFull(self.retry_after)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+        return job
+
+    def _evict(self):
+        # Старые завершенные задачи удаляются первыми
+        excess = len(self._jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.status in (DONE, FAILED)][:excess]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.status = RUNNING
+            try:
+                job.cache_key, result = self.render(job.document_id)
+                job.size = len(result)
+                job.status = DONE
+                self.completed += 1
+            except Exception as error:
+                job.error = str(error)
+                job.status = FAILED
+                self.failed += 1
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self._queue.qsize(),
+            "completed": self.completed,
+            "failed": self.failed
+        }
@@ -0,0 +1,147 @@
+"""
+Рендер документов в пуле процессов
+Генерация .docx - чистая CPU-работа на Python, в потоках Flask она упирается в GIL.
+Процессы-воркеры держат прогретый DocumentGenerator; очередь ограничена
+"""
+
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from document_generator import DocumentGenerator
+from render_cache import RenderCache
+
+_generator = None
+
+
+class RenderQueueFull(Exception):
+    """Все воркеры заняты и очередь заполнена"""
+    def __init__(self, retry_after):
+        super().__init__("Очередь рендера заполнена")
+        self.retry_after = retry_after
+
+
+class RenderTimeout(Exception):
+    """Рендер не уложился в отведенное время"""
+
+
+def _init_worker(templates_dir, fragment_cache_bytes):
+    global _generator
+    # У каждого воркера свой кэш разделов: при потоковом backend правка пересобирает
+    # только изменившиеся разделы и в пуле, как в основном процессе
+    fragment_cache = RenderCache(max_bytes=fragment_cache_bytes) if fragment_cache_bytes > 0 else None
+    _generator = DocumentGenerator(templates_dir=templates_dir, fragment_cache=fragment_cache)
+    _generator.warm_up()
+
+
+def _ping():
+    return True
+
+
+def _render_wizard(answers, creation_date, backend):
+    return _generator.render_wizard_bytes(answers, creation_date, backend)
+
+
+def _render_wizard_pdf(answers, creation_date):
+    return _generator.render_wizard_pdf(answers, creation_date)
+
+
+class RenderPool:
+    def __init__(self, workers, templates_dir, max_queue=None, timeout=30, retry_after=1, fragment_cache_bytes=0):
+        self.workers = workers
+        self.templates_dir = templates_dir
+        self.fragment_cache_bytes = fragment_cache_bytes
+        self.max_queue = workers * 4 if max_queue is None else max_queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.rejected = 0
+        self.timeouts = 0
+        self.in_flight = 0
+        # Слоты допуска: работающие + ожидающие задачи
+        self._slots = threading.BoundedSemaphore(workers + self.max_queue)
+        self._lock = threading.Lock()
+        # Исполнитель создается при первом рендере в своем процессе: его очереди и каналы
+        # нельзя делить между воркерами, которые gunicorn --preload получает через fork
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # multiprocessing нужен только при включенном пуле, а не при каждом импорте
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.templates_dir, self.fragment_cache_bytes)
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def warm_up(self):
+        """Запускает все процессы заранее, чтобы первый запрос не ждал старта воркера"""
+        executor = self._get_executor()
+        futures = [executor.submit(_ping) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def _release(self, _future):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def render_wizard(self, answers, creation_date, backend, wait_for_slot=False):
+        """
+        Рендерит .docx в воркере и возвращает байты.
+        Без wait_for_slot при заполненной очереди сразу бросает RenderQueueFull
+        """
+        return self._run(_render_wizard, (answers, creation_date, backend), wait_for_slot)
+
+    def render_wizard_pdf(self, answers, creation_date, wait_for_slot=False):
+        """Рендерит PDF в воркере, правила очереди те же, что у render_wizard"""
+        return self._run(_render_wizard_pdf, (answers, creation_date), wait_for_slot)
+
+    def _run(self, fn, args, wait_for_slot):
+        acquired = self._slots.acquire(timeout=self.timeout) if wait_for_slot else self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                self.rejected += 1
+            raise RenderQueueFull(self.retry_after)
+
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Уже запущенную задачу не прервать, но слот освободится по её завершении
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise RenderTimeout(f"Рендер не завершился за {self.timeout} с")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor if self._pid == os.getpid() else None
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,420 @@
+"""
+Полнотекстовый поиск по документам пользователя
+Инвертированный индекс по названию и ответам о шагах, безопасности и качестве
+(q5, q6, q7): слова приводятся к основе стеммером Snowball для русского языка,
+результаты ранжируются по BM25. Индекс разбит по пользователям, поэтому запрос
+перебирает только документы владельца, начиная с самого редкого слова запроса.
+SearchIndex держит индекс в памяти процесса (хранилище memory), SQLiteSearchIndex -
+в таблице FTS5 той же базы, общей для всех воркеров
+"""
+
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+
+from text_parser import EMPTY_VALUES
+
+# Поле ответа и вес его слов: совпадение в названии важнее совпадения в шагах
+SEARCH_FIELDS = (('q5', 1), ('q6', 1), ('q7', 1))
+TITLE_WEIGHT = 3
+
+# Параметры BM25
+K1 = 1.2
+B = 0.75
+
+WORD = re.compile(r'[^\W_]+')
+CYRILLIC_WORD = re.compile(r'[а-я]+')
+
+STOP_WORDS = frozenset((
+    'а', 'без', 'бы', 'в', 'во', 'все', 'всех', 'вы', 'да', 'для', 'до', 'его', 'ее', 'если',
+    'есть', 'же', 'за', 'и', 'из', 'или', 'им', 'их', 'к', 'как', 'ко', 'ли', 'мы', 'на',
+    'над', 'не', 'нет', 'ни', 'но', 'о', 'об', 'от', 'по', 'под', 'при', 'про', 'с', 'со',
+    'так', 'также', 'то', 'только', 'у', 'что', 'чтобы', 'это', 'этот'
+))
+
+# Стеммер Snowball (snowballstem.org/algorithms/russian): окончания снимаются внутри RV -
+# части слова после первой гласной. Поиск регулярного выражения идет слева направо,
+# поэтому снимается самое длинное из подходящих окончаний
+VOWELS = 'аеиоуыэюя'
+RV = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+PERFECTIVE_GERUND = re.compile(r'(?:ив|ивши|ившись|ыв|ывши|ывшись|(?<=[ая])(?:в|вши|вшись))$')
+REFLEXIVE = re.compile(r'(?:ся|сь)$')
+ADJECTIVAL = re.compile(
+    r'(?:ивш|ывш|ующ|(?<=[ая])(?:ем|нн|вш|ющ|щ))?'
+    r'(?:ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$'
+)
+VERB = re.compile(
+    r'(?:ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|'
+    r'ены|ить|ыть|ишь|ую|ю|(?<=[ая])(?:ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно))$'
+)
+NOUN = re.compile(
+    r'(?:а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|'
+    r'ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+DERIVATIONAL = re.compile(r'ость?$')
+SUPERLATIVE = re.compile(r'ейше?$')
+
+
+def _region(word, start):
+    """Начало области после первой согласной, которая идет за гласной (R1, R2 Snowball)"""
+    for i in range(start + 1, len(word)):
+        if word[i - 1] in VOWELS and word[i] not in VOWELS:
+            return i + 1
+    return len(word)
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    """Основа русского слова в нижнем регистре; прочие слова возвращаются как есть"""
+    if not CYRILLIC_WORD.fullmatch(word):
+        return word
+    match = RV.match(word)
+    if match is None:
+        return word
+    head, rv = match.groups()
+    r2 = _region(word, _region(word, 0)) - len(head)
+
+    stripped = PERFECTIVE_GERUND.sub('', rv, 1)
+    if stripped == rv:
+        rv = REFLEXIVE.sub('', rv, 1)
+        stripped = ADJECTIVAL.sub('', rv, 1)
+        if stripped == rv:
+            stripped = VERB.sub('', rv, 1)
+            if stripped == rv:
+                stripped = NOUN.sub('', rv, 1)
+    rv = stripped
+
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    derivational = DERIVATIONAL.search(rv)
+    if derivational is not None and derivational.start() >= r2:
+        rv = rv[:derivational.start()]
+
+    superlative = SUPERLATIVE.search(rv)
+    if superlative is not None:
+        rv = rv[:superlative.start()]
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+    elif rv.endswith('нн'):
+        rv = rv[:-1]
+    elif rv.endswith('ь'):
+        rv = rv[:-1]
+    return head + rv
+
+
+def analyze(text):
+    """Основы слов текста без стоп-слов"""
+    if not isinstance(text, str) or text in EMPTY_VALUES:
+        return []
+    return [
+        stem(word) for word in WORD.findall(text.lower().replace('ё', 'е'))
+        if word not in STOP_WORDS and (len(word) > 1 or word.isdigit())
+    ]
+
+
+class _UserIndex:
+    """Индекс документов одного пользователя"""
+    __slots__ = ('postings', 'documents', 'lengths', 'total_length')
+
+    def __init__(self):
+        self.postings = {}     # основа -> {doc_id: взвешенная частота}
+        self.documents = {}    # doc_id -> (title, created_at, основы)
+        self.lengths = {}      # doc_id -> взвешенная длина
+        self.total_length = 0
+
+
+class SearchIndex:
+    def __init__(self):
+        self.loaded = False
+        self._users = {}       # user_id -> _UserIndex
+        self._owners = {}      # doc_id -> user_id
+        self._removed = set()  # удаленные, пока шла первичная загрузка
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @staticmethod
+    def _terms(document):
+        counts = Counter()
+        for term in analyze(document["title"]):
+            counts[term] += TITLE_WEIGHT
+        answers = document["answers"]
+        for field, weight in SEARCH_FIELDS:
+            for term in analyze(answers.get(field)):
+                counts[term] += weight
+        return counts
+
+    def add(self, document, replace=True):
+        """Индексирует документ; прежняя версия того же doc_id заменяется"""
+        counts = self._terms(document)
+        doc_id = document["id"]
+        with self._lock:
+            if doc_id in self._owners:
+                if not replace:
+                    return
+                self._remove(doc_id)
+            elif not replace and doc_id in self._removed:
+                return
+            index = self._users.get(document["user_id"])
+            if index is None:
+                index = self._users[document["user_id"]] = _UserIndex()
+            length = sum(counts.values())
+            for term, count in counts.items():
+                postings = index.postings.get(term)
+                if postings is None:
+                    postings = index.postings[term] = {}
+                postings[doc_id] = count
+            index.documents[doc_id] = (document["title"], document["created_at"], tuple(counts))
+            index.lengths[doc_id] = length
+            index.total_length += length
+            self._owners[doc_id] = document["user_id"]
+
+    def remove(self, doc_id):
+        with self._lock:
+            if not self.loaded:
+                self._removed.add(doc_id)
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        user_id = self._owners.pop(doc_id, None)
+        if user_id is None:
+            return
+        index = self._users[user_id]
+        _, _, terms = index.documents.pop(doc_id)
+        length = index.lengths.pop(doc_id)
+        for term in terms:
+            postings = index.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del index.postings[term]
+        index.total_length -= length
+        if not index.documents:
+            del self._users[user_id]
+
+    def ensure_loaded(self, documents):
+        """
+        Первый вызов индексирует уже сохраненные документы (documents() - итератор
+        по хранилищу). Документы, добавленные или удаленные во время загрузки, не
+        перезаписываются ее устаревшими копиями
+        """
+        if self.loaded:
+            return
+        with self._load_lock:
+            if self.loaded:
+                return
+            for document in documents():
+                self.add(document, replace=False)
+            with self._lock:
+                self.loaded = True
+                self._removed.clear()
+
+    def search(self, user_id, query, limit=20, offset=0):
+        """
+        (число найденных, страница [(doc_id, title, created_at, score)]).
+        Находятся документы со всеми словами запроса, лучшие по BM25 первыми
+        """
+        terms = list(dict.fromkeys(analyze(query)))
+        if not terms:
+            return 0, []
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                return 0, []
+            postings = [index.postings.get(term) for term in terms]
+            if any(posting is None for posting in postings):
+                return 0, []
+            # Под блокировкой только копии словарей (на C); BM25 считается без нее,
+            # чтобы долгий запрос не задерживал add() и remove()
+            postings = [posting.copy() for posting in postings]
+            lengths = index.lengths.copy()
+            count = len(index.documents)
+            total_length = index.total_length
+
+        # Пересечение множеств doc_id считается на C, счет - только для совпавших
+        postings.sort(key=len)
+        candidates = postings[0].keys()
+        for posting in postings[1:]:
+            candidates = candidates & posting.keys()
+
+        weighted = [
+            (math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5)) * (K1 + 1), posting)
+            for posting in postings
+        ]
+        base, slope = K1 * (1 - B), K1 * B * count / total_length
+
+        def score(doc_id):
+            norm = base + slope * lengths[doc_id]
+            total = 0.0
+            for weight, posting in weighted:
+                frequency = posting[doc_id]
+                total += weight * frequency / (frequency + norm)
+            return total
+
+        top = heapq.nlargest(offset + limit, candidates, key=score)[offset:]
+        page = []
+        with self._lock:
+            # Документ могли удалить, пока шел подсчет
+            documents = self._users[user_id].documents if user_id in self._users else {}
+            for doc_id in top:
+                document = documents.get(doc_id)
+                if document is not None:
+                    page.append((doc_id, document[0], document[1], score(doc_id)))
+        return len(candidates), page
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "documents": len(self._owners),
+                "users": len(self._users),
+                "terms": sum(len(index.postings) for index in self._users.values())
+            }
+
+
+SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_documents (
+    id INTEGER PRIMARY KEY,
+    doc_id TEXT NOT NULL UNIQUE,
+    user_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS search_terms USING fts5(
+    owner, title, body, tokenize = 'unicode61 remove_diacritics 0'
+);
+"""
+
+# Версия анализатора: при смене стеммера или полей индекс строится заново
+SEARCH_VERSION = '1'
+
+SELECT_SEARCH_VERSION = "SELECT value FROM search_meta WHERE key = 'version'"
+UPSERT_SEARCH_VERSION = "INSERT OR REPLACE INTO search_meta (key, value) VALUES ('version', ?)"
+SELECT_SEARCH_ROW = "SELECT id FROM search_documents WHERE doc_id = ?"
+INSERT_SEARCH_DOCUMENT = "INSERT INTO search_documents (doc_id, user_id, title, created_at) VALUES (?, ?, ?, ?)"
+INSERT_SEARCH_TERMS = "INSERT INTO search_terms (rowid, owner, title, body) VALUES (?, ?, ?, ?)"
+DELETE_SEARCH_DOCUMENT = "DELETE FROM search_documents WHERE id = ?"
+DELETE_SEARCH_TERMS = "DELETE FROM search_terms WHERE rowid = ?"
+CLEAR_SEARCH = ("DELETE FROM search_documents", "DELETE FROM search_terms")
+# Веса столбцов bm25(): владелец в счет не идет, название - как TITLE_WEIGHT
+SEARCH_PAGE = (
+    "SELECT d.doc_id, d.title, d.created_at, -bm25(search_terms, 0.0, 3.0, 1.0) "
+    "FROM search_terms JOIN search_documents d ON d.id = search_terms.rowid "
+    "WHERE search_terms MATCH ? ORDER BY bm25(search_terms, 0.0, 3.0, 1.0) LIMIT ? OFFSET ?"
+)
+SEARCH_COUNT = "SELECT COUNT(*) FROM search_terms WHERE search_terms MATCH ?"
+SEARCH_STATS = "SELECT COUNT(*), COUNT(DISTINCT user_id) FROM search_documents"
+
+
+def _owner_token(user_id):
+    # Владелец - одно слово из шестнадцатеричных цифр: фильтр по нему идет внутри FTS5
+    return 'u' + str(user_id).encode('utf-8').hex()
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+class SQLiteSearchIndex:
+    """
+    Тот же поиск поверх FTS5 в базе SQLiteStorage. В таблицу пишутся основы слов
+    после analyze(), поэтому стеммер и стоп-слова общие с SearchIndex, а изменения
+    из одного воркера сразу видны в поиске остальных
+    """
+    def __init__(self, connection):
+        # connection() - соединение SQLite текущего потока
+        self._connection = connection
+        self.loaded = False
+        self._load_lock = threading.Lock()
+        connection().executescript(SEARCH_SCHEMA)
+
+    @staticmethod
+    def _texts(document):
+        answers = document["answers"]
+        body = []
+        for field, _ in SEARCH_FIELDS:
+            body.extend(analyze(answers.get(field)))
+        return ' '.join(analyze(document["title"])), ' '.join(body)
+
+    def _add(self, conn, document, replace):
+        row = conn.execute(SELECT_SEARCH_ROW, (document["id"],)).fetchone()
+        if row is not None:
+            if not replace:
+                return
+            conn.execute(DELETE_SEARCH_TERMS, row)
+            conn.execute(DELETE_SEARCH_DOCUMENT, row)
+        title, body = self._texts(document)
+        rowid = conn.execute(INSERT_SEARCH_DOCUMENT, (
+            document["id"], document["user_id"], document["title"], document["created_at"]
+        )).lastrowid
+        conn.execute(INSERT_SEARCH_TERMS, (rowid, _owner_token(document["user_id"]), title, body))
+
+    def add(self, document, replace=True):
+        """Индексирует документ; прежняя версия того же doc_id заменяется"""
+        conn = self._connection()
+        with conn:
+            self._add(conn, document, replace)
+
+    def remove(self, doc_id):
+        conn = self._connection()
+        with conn:
+            row = conn.execute(SELECT_SEARCH_ROW, (doc_id,)).fetchone()
+            if row is not None:
+                conn.execute(DELETE_SEARCH_TERMS, row)
+                conn.execute(DELETE_SEARCH_DOCUMENT, row)
+
+    def ensure_loaded(self, documents):
+        """
+        Индекс уже в базе; первый вызов в процессе только проверяет версию и при
+        пустой или устаревшей таблице строит ее заново из documents(). Построение
+        идет в одной транзакции записи, поэтому воркеры не делают его дважды
+        """
+        if self.loaded:
+            return
+        with self._load_lock:
+            if self.loaded:
+                return
+            conn = self._connection()
+            row = conn.execute(SELECT_SEARCH_VERSION).fetchone()
+            if row is None or row[0] != SEARCH_VERSION:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute(SELECT_SEARCH_VERSION).fetchone()
+                    if row is None or row[0] != SEARCH_VERSION:
+                        for statement in CLEAR_SEARCH:
+                            conn.execute(statement)
+                        for document in list(documents()):
+                            self._add(conn, document, replace=True)
+                        conn.execute(UPSERT_SEARCH_VERSION, (SEARCH_VERSION,))
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+            self.loaded = True
+
+    def search(self, user_id, query, limit=20, offset=0):
+        """Как SearchIndex.search; BM25 считает FTS5"""
+        terms = list(dict.fromkeys(analyze(query)))
+        if not terms:
+            return 0, []
+        match = ' '.join(['owner:' + _owner_token(user_id)] + ['{title body}:' + _quote(term) for term in terms])
+        conn = self._connection()
+        total = conn.execute(SEARCH_COUNT, (match,)).fetchone()[0]
+        if not total:
+            return 0, []
+        page = [tuple(row) for row in conn.execute(SEARCH_PAGE, (match, limit, offset))]
+        return total, page
+
+    def stats(self):
+        documents, users = self._connection().execute(SEARCH_STATS).fetchone()
+        return {
+            "loaded": self.loaded,
+            "documents": documents,
+            "users": users
+        }
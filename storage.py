@@ -0,0 +1,402 @@
+"""
+Хранилище пользователей и документов
+MemoryStorage - словари в памяти процесса (разработка и тесты),
+SQLiteStorage - общий файл БД в режиме WAL для нескольких воркеров gunicorn
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+
+# Ответы мастера, которые хранятся позиционно в DocumentRecord
+ANSWER_KEYS = ('q1', 'q2', 'q3', 'q4', 'q5', 'q6', 'q7', 'q8')
+# Короткие ответы, которые повторяются у разных документов (компания, исполнители,
+# техника безопасности, контроль качества); свободный текст шагов и описаний уникален
+SHARED_KEYS = frozenset(('q1', 'q3', 'q6', 'q7'))
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# Нет ответа (в отличие от ответа null)
+_MISSING = object()
+
+
+def encode_cursor(document):
+    """Непрозрачный курсор пагинации: позиция документа в порядке (created_at, id)"""
+    raw = f"{document['created_at']}|{document['id']}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Обратное к encode_cursor; ValueError для испорченного курсора"""
+    try:
+        created_at, doc_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|', 1)
+        datetime.fromisoformat(created_at)
+    except (UnicodeError, ValueError):
+        raise ValueError("Некорректный курсор")
+    return created_at, doc_id
+
+
+def to_timestamp(created_at):
+    """ISO-время без часового пояса -> целые микросекунды (обратимо без потерь)"""
+    return (datetime.fromisoformat(created_at) - _EPOCH) // _MICROSECOND
+
+
+def from_timestamp(timestamp):
+    return (_EPOCH + timestamp * _MICROSECOND).isoformat()
+
+
+class StringPool:
+    """
+    Общие экземпляры одинаковых строк со счетчиком документов. В отличие от sys.intern
+    (в CPython 3.12 интернированные строки не освобождаются) строка уходит из пула
+    вместе с последним документом, который на нее ссылается
+    """
+    def __init__(self):
+        self._strings = {}  # строка -> [общий экземпляр, число ссылок]
+
+    def share(self, value):
+        if type(value) is not str:
+            return value
+        entry = self._strings.get(value)
+        if entry is None:
+            entry = self._strings[value] = [value, 0]
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, value):
+        if type(value) is not str:
+            return
+        entry = self._strings.get(value)
+        if entry is not None:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._strings[value]
+
+    def __len__(self):
+        return len(self._strings)
+
+
+class DocumentRecord:
+    """
+    Компактная запись документа в памяти: ответы q1..q8 - кортеж строк (повторяющиеся
+    берутся из StringPool), время - целое число микросекунд, заголовок хранится,
+    только если отличается от q2
+    """
+    __slots__ = ('id', 'user_id', 'title', 'answers', 'extra', 'created_at')
+
+    def __init__(self, id, user_id, title, answers, extra, created_at):
+        self.id = id
+        self.user_id = user_id
+        self.title = title
+        self.answers = answers
+        self.extra = extra
+        self.created_at = created_at
+
+    @classmethod
+    def from_dict(cls, document, pool):
+        """Запись из словаря; user_id и ответы SHARED_KEYS берутся из pool"""
+        answers = document["answers"]
+        values = tuple(
+            pool.share(answers.get(key, _MISSING)) if key in SHARED_KEYS else answers.get(key, _MISSING)
+            for key in ANSWER_KEYS
+        )
+        extra = {key: value for key, value in answers.items() if key not in ANSWER_KEYS}
+        title = document["title"]
+        return cls(
+            document["id"],
+            pool.share(document["user_id"]),
+            None if title == answers.get('q2') else title,
+            values,
+            extra or None,
+            to_timestamp(document["created_at"])
+        )
+
+    def release(self, pool):
+        """Возвращает в pool строки, взятые from_dict"""
+        pool.release(self.user_id)
+        for key, value in zip(ANSWER_KEYS, self.answers):
+            if key in SHARED_KEYS:
+                pool.release(value)
+
+    def answers_dict(self):
+        answers = {key: value for key, value in zip(ANSWER_KEYS, self.answers) if value is not _MISSING}
+        if self.extra:
+            answers.update(self.extra)
+        return answers
+
+    def to_dict(self):
+        """Документ в прежнем виде словаря; собирается заново на каждое чтение"""
+        answers = self.answers_dict()
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "title": answers.get('q2') if self.title is None else self.title,
+            "answers": answers,
+            "created_at": from_timestamp(self.created_at)
+        }
+
+
+class MemoryStorage:
+    """
+    Пользователи и документы в памяти процесса за интерфейсом хранилища.
+    Документы хранятся как DocumentRecord, наружу отдаются словарями
+    """
+    def __init__(self):
+        self.users = {}
+        self.documents = {}
+        # user_id -> отсортированный список (created_at в мкс, doc_id)
+        self._by_user = {}
+        self._strings = StringPool()
+        self._lock = threading.Lock()
+
+    def add_user(self, user):
+        """Сохраняет пользователя; False, если email уже занят"""
+        with self._lock:
+            if user["email"] in self.users:
+                return False
+            self.users[user["email"]] = user
+            return True
+
+    def get_user_by_email(self, email):
+        return self.users.get(email)
+
+    def update_user_password(self, email, password):
+        with self._lock:
+            user = self.users.get(email)
+            if user is None:
+                return False
+            self.users[email] = {**user, "password": password}
+            return True
+
+    def add_document(self, document):
+        with self._lock:
+            record = DocumentRecord.from_dict(document, self._strings)
+            self.documents[record.id] = record
+            insort(self._by_user.setdefault(record.user_id, []), (record.created_at, record.id))
+
+    def get_document(self, doc_id):
+        record = self.documents.get(doc_id)
+        return record.to_dict() if record is not None else None
+
+    def update_document(self, doc_id, answers, title):
+        """Новые ответы и заголовок; created_at и место в индексе не меняются"""
+        with self._lock:
+            record = self.documents.get(doc_id)
+            if record is None:
+                return False
+            self.documents[doc_id] = DocumentRecord.from_dict({
+                "id": doc_id,
+                "user_id": record.user_id,
+                "title": title,
+                "answers": answers,
+                "created_at": from_timestamp(record.created_at)
+            }, self._strings)
+            record.release(self._strings)
+            return True
+
+    def delete_document(self, doc_id):
+        with self._lock:
+            record = self.documents.pop(doc_id, None)
+            if record is None:
+                return False
+            record.release(self._strings)
+            keys = self._by_user[record.user_id]
+            del keys[bisect_left(keys, (record.created_at, doc_id))]
+            if not keys:
+                del self._by_user[record.user_id]
+            return True
+
+    def iter_documents(self):
+        """Все документы (снимок на момент вызова)"""
+        with self._lock:
+            records = list(self.documents.values())
+        for record in records:
+            yield record.to_dict()
+
+    def list_user_documents(self, user_id, limit=None, after=None, descending=False):
+        """
+        Документы пользователя в порядке created_at без обхода всей базы.
+        after - ключ (created_at, doc_id) последнего документа предыдущей страницы
+        """
+        if after:
+            after = (to_timestamp(after[0]), after[1])
+        with self._lock:
+            keys = self._by_user.get(user_id, [])
+            if descending:
+                end = bisect_left(keys, after) if after else len(keys)
+                start = max(0, end - limit) if limit is not None else 0
+                selected = keys[start:end][::-1]
+            else:
+                start = bisect_right(keys, after) if after else 0
+                end = start + limit if limit is not None else len(keys)
+                selected = keys[start:end]
+            records = [self.documents[doc_id] for _, doc_id in selected]
+        return [record.to_dict() for record in records]
+
+    def count_users(self):
+        return len(self.users)
+
+    def count_documents(self):
+        return len(self.documents)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    password TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email);
+
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    answers TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_user_created ON documents (user_id, created_at, id);
+"""
+
+# Запросы - константы: sqlite3 кэширует подготовленные выражения по тексту SQL
+INSERT_USER = "INSERT INTO users (id, email, password, created_at) VALUES (?, ?, ?, ?)"
+SELECT_USER_BY_EMAIL = "SELECT id, email, password, created_at FROM users WHERE email = ?"
+UPDATE_USER_PASSWORD = "UPDATE users SET password = ? WHERE email = ?"
+INSERT_DOCUMENT = "INSERT INTO documents (id, user_id, title, answers, created_at) VALUES (?, ?, ?, ?, ?)"
+SELECT_DOCUMENT = "SELECT id, user_id, title, answers, created_at FROM documents WHERE id = ?"
+UPDATE_DOCUMENT = "UPDATE documents SET title = ?, answers = ? WHERE id = ?"
+DELETE_DOCUMENT = "DELETE FROM documents WHERE id = ?"
+SELECT_ALL_DOCUMENTS = "SELECT id, user_id, title, answers, created_at FROM documents"
+# Постраничная выборка идет по индексу (user_id, created_at, id); LIMIT -1 - без ограничения
+SELECT_USER_DOCUMENTS = {
+    (False, False): "SELECT id, user_id, title, answers, created_at FROM documents "
+                    "WHERE user_id = ? ORDER BY created_at, id LIMIT ?",
+    (False, True): "SELECT id, user_id, title, answers, created_at FROM documents "
+                   "WHERE user_id = ? AND (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?",
+    (True, False): "SELECT id, user_id, title, answers, created_at FROM documents "
+                   "WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+    (True, True): "SELECT id, user_id, title, answers, created_at FROM documents "
+                  "WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?"
+}
+COUNT_USERS = "SELECT COUNT(*) FROM users"
+COUNT_DOCUMENTS = "SELECT COUNT(*) FROM documents"
+
+
+class SQLiteStorage:
+    """
+    SQLite в режиме WAL: читатели не блокируют писателя, поэтому несколько
+    процессов могут работать с одним файлом. Соединения живут по одному на поток
+    и переоткрываются после fork
+    """
+    def __init__(self, path, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def connection(self):
+        """Соединение текущего потока; через него же работает индекс поиска FTS5"""
+        return self._connection()
+
+    @staticmethod
+    def _user(row):
+        if row is None:
+            return None
+        return {"id": row[0], "email": row[1], "password": row[2], "created_at": row[3]}
+
+    @staticmethod
+    def _document(row):
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "user_id": row[1],
+            "title": row[2],
+            "answers": json.loads(row[3]),
+            "created_at": row[4]
+        }
+
+    def add_user(self, user):
+        conn = self._connection()
+        try:
+            with conn:
+                conn.execute(INSERT_USER, (user["id"], user["email"], user["password"], user["created_at"]))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def get_user_by_email(self, email):
+        return self._user(self._connection().execute(SELECT_USER_BY_EMAIL, (email,)).fetchone())
+
+    def update_user_password(self, email, password):
+        conn = self._connection()
+        with conn:
+            return conn.execute(UPDATE_USER_PASSWORD, (password, email)).rowcount > 0
+
+    def add_document(self, document):
+        conn = self._connection()
+        with conn:
+            conn.execute(INSERT_DOCUMENT, (
+                document["id"],
+                document["user_id"],
+                document["title"],
+                json.dumps(document["answers"], ensure_ascii=False),
+                document["created_at"]
+            ))
+
+    def get_document(self, doc_id):
+        return self._document(self._connection().execute(SELECT_DOCUMENT, (doc_id,)).fetchone())
+
+    def update_document(self, doc_id, answers, title):
+        conn = self._connection()
+        with conn:
+            return conn.execute(
+                UPDATE_DOCUMENT, (title, json.dumps(answers, ensure_ascii=False), doc_id)
+            ).rowcount > 0
+
+    def delete_document(self, doc_id):
+        conn = self._connection()
+        with conn:
+            return conn.execute(DELETE_DOCUMENT, (doc_id,)).rowcount > 0
+
+    def iter_documents(self):
+        for row in self._connection().execute(SELECT_ALL_DOCUMENTS):
+            yield self._document(row)
+
+    def list_user_documents(self, user_id, limit=None, after=None, descending=False):
+        query = SELECT_USER_DOCUMENTS[(descending, after is not None)]
+        params = (user_id,) + (tuple(after) if after else ()) + (-1 if limit is None else limit,)
+        rows = self._connection().execute(query, params).fetchall()
+        return [self._document(row) for row in rows]
+
+    def count_users(self):
+        return self._connection().execute(COUNT_USERS).fetchone()[0]
+
+    def count_documents(self):
+        return self._connection().execute(COUNT_DOCUMENTS).fetchone()[0]
+
+
+def create_storage(url):
+    """'memory' или 'sqlite:///path/to/howdo.db'"""
+    if url == 'memory':
+        return MemoryStorage()
+    if url.startswith('sqlite:///'):
+        return SQLiteStorage(url[len('sqlite:///'):])
+    raise ValueError(f"Неизвестное хранилище: {url}")
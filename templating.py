@@ -0,0 +1,85 @@
+"""
+Jinja-окружение для HTML-шаблонов из templates/ и подготовка данных для них
+"""
+
+import os
+import re
+
+from jinja2 import BaseLoader, Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from text_parser import parse_list
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# Имя вида 'sok_template.html#body' - только динамическая середина шаблона
+BODY_SUFFIX = '#body'
+JINJA_TAG = re.compile(r'{{|{%|}}|%}')
+
+
+def split_static(source):
+    """
+    Делит исходник шаблона на статичное начало, динамическую середину и статичный конец.
+    Начало (head со стилями, шапка) и конец не содержат тегов Jinja
+    """
+    tags = list(JINJA_TAG.finditer(source))
+    if not tags:
+        return source, '', ''
+    start = tags[0].start()
+    end = tags[-1].end()
+    return source[:start], source[start:end], source[end:]
+
+
+class FragmentLoader(BaseLoader):
+    """
+    FileSystemLoader, который по имени с суффиксом #body отдает только середину шаблона.
+    Так середина компилируется и попадает в кэш байткода как обычный шаблон
+    """
+    def __init__(self, templates_dir):
+        self.files = FileSystemLoader(templates_dir)
+
+    def get_source(self, environment, template):
+        if template.endswith(BODY_SUFFIX):
+            source, filename, uptodate = self.files.get_source(environment, template[:-len(BODY_SUFFIX)])
+            return split_static(source)[1], filename, uptodate
+        return self.files.get_source(environment, template)
+
+    def list_templates(self):
+        return self.files.list_templates()
+
+
+def _autoescape(name):
+    # Середины шаблонов (#body) экранируются так же, как сами .html-файлы
+    if name is None:
+        return True
+    if name.endswith(BODY_SUFFIX):
+        name = name[:-len(BODY_SUFFIX)]
+    return name.endswith(('.html', '.htm', '.xml'))
+
+
+def create_environment(templates_dir=TEMPLATES_DIR, bytecode_cache_dir=None):
+    """
+    Окружение создается один раз на процесс: скомпилированные шаблоны кэшируются в нем,
+    а байткод - на диске, чтобы новые воркеры не компилировали шаблоны заново
+    """
+    return Environment(
+        loader=FragmentLoader(templates_dir),
+        autoescape=_autoescape,
+        bytecode_cache=FileSystemBytecodeCache(bytecode_cache_dir),
+        auto_reload=False
+    )
+
+
+def wizard_sok_context(answers, creation_date):
+    """Переменные sok_template.html по ответам мастера (q1..q8)"""
+    steps = parse_list(answers.get('q5', ''))
+    safety = parse_list(answers.get('q6', ''))
+    return {
+        "operation_name": answers.get('q2', 'Не указано'),
+        "work_position": answers.get('q3', ''),
+        "steps": [
+            {"order": f"Этап {i}", "content": step}
+            for i, step in enumerate(steps, 1)
+        ],
+        "safety_risks": '; '.join(safety),
+        "approval_date": creation_date
+    }
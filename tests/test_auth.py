@@ -0,0 +1,113 @@
+"""Пароли, токены сессий и доступ к документам только их владельцу"""
+
+import pytest
+
+import app as howdo
+from auth import hash_password, needs_rehash, verify_password, _b64decode, _b64encode
+from search_index import SearchIndex
+from storage import MemoryStorage
+
+ITERATIONS = 1000
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(howdo, 'storage', MemoryStorage())
+    monkeypatch.setattr(howdo, 'search_index', SearchIndex())
+    monkeypatch.setattr(howdo, 'PASSWORD_ITERATIONS', ITERATIONS)
+    monkeypatch.setattr(howdo, 'rate_limiter', None)
+    monkeypatch.setattr(howdo, 'auth_rate_limiter', None)
+    monkeypatch.setattr(howdo, 'AUTH_REQUIRED', True)
+    return howdo.app.test_client()
+
+
+def login(client, email, password='секрет'):
+    client.post('/api/register', json={'email': email, 'password': password})
+    response = client.post('/api/login', json={'email': email, 'password': password})
+    assert response.status_code == 200
+    return {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+
+def create_document(client, headers, **body):
+    response = client.post('/api/wizard', json={'answers': {'q2': 'Сборка узла'}, **body}, headers=headers)
+    assert response.status_code == 200
+    return response.get_json()['document_id']
+
+
+def test_hash_and_verify():
+    stored = hash_password('секрет', ITERATIONS)
+    assert stored.startswith(f'pbkdf2_sha256${ITERATIONS}$')
+    assert verify_password('секрет', stored)
+    assert not verify_password('Секрет', stored)
+    assert hash_password('секрет', ITERATIONS) != stored
+
+
+def test_needs_rehash():
+    stored = hash_password('секрет', ITERATIONS)
+    assert not needs_rehash(stored, ITERATIONS)
+    assert needs_rehash(stored, ITERATIONS * 2)
+    # Пароль, сохраненный до хэширования
+    assert verify_password('секрет', 'секрет')
+    assert needs_rehash('секрет', ITERATIONS)
+
+
+def test_login_rehashes_legacy_password(client):
+    howdo.storage.add_user({'id': 'u1', 'email': 'old@example.com', 'password': 'секрет', 'created_at': ''})
+    assert client.post('/api/login', json={'email': 'old@example.com', 'password': 'секрет'}).status_code == 200
+    stored = howdo.storage.get_user_by_email('old@example.com')['password']
+    assert not needs_rehash(stored, ITERATIONS)
+    assert verify_password('секрет', stored)
+
+
+def test_unknown_email_checked_against_dummy_hash(client, monkeypatch):
+    checked = []
+    monkeypatch.setattr(howdo, 'verify_password', lambda password, stored: checked.append(stored) or False)
+    response = client.post('/api/login', json={'email': 'nobody@example.com', 'password': 'секрет'})
+    assert response.status_code == 401
+    assert checked == [howdo.dummy_hash(ITERATIONS)]
+
+
+def test_forged_token_rejected(client):
+    headers = login(client, 'a@example.com')
+    token = headers['Authorization'][len('Bearer '):]
+    payload, signature = token.split('.')
+    forged = _b64encode(_b64decode(payload).replace(b'"uid":"', b'"uid":"x'))
+    for bad in (f'{forged}.{signature}', f'{payload}.{signature[:-2]}AA', 'мусор'):
+        response = client.get('/api/documents', headers={'Authorization': f'Bearer {bad}'})
+        assert response.status_code == 401
+
+
+def test_expired_token_rejected(client, monkeypatch):
+    monkeypatch.setattr(howdo.sessions, 'max_age', -1)
+    headers = login(client, 'a@example.com')
+    assert client.get('/api/documents', headers=headers).status_code == 401
+
+
+def test_wizard_requires_token(client):
+    response = client.post('/api/wizard', json={'user_id': 'victim', 'answers': {'q2': 'Чужой'}})
+    assert response.status_code == 401
+    assert howdo.storage.count_documents() == 0
+
+
+def test_other_users_document_not_found(client):
+    owner = login(client, 'owner@example.com')
+    other = login(client, 'other@example.com')
+    doc_id = create_document(client, owner)
+
+    assert client.patch(f'/api/documents/{doc_id}', json={'answers': {'q2': 'Взлом'}}, headers=other).status_code == 404
+    assert client.delete(f'/api/documents/{doc_id}', headers=other).status_code == 404
+    assert client.get('/api/documents', headers=other).get_json()['documents'] == []
+
+    assert howdo.storage.get_document(doc_id)['title'] == 'Сборка узла'
+    assert client.delete(f'/api/documents/{doc_id}', headers=owner).status_code == 200
+
+
+def test_auth_not_required_uses_user_id_from_request(client, monkeypatch):
+    monkeypatch.setattr(howdo, 'AUTH_REQUIRED', False)
+    doc_id = create_document(client, {}, user_id='legacy')
+
+    documents = client.get('/api/documents', query_string={'user_id': 'legacy'}).get_json()['documents']
+    assert [document['id'] for document in documents] == [doc_id]
+    # Токен по-прежнему важнее user_id из запроса
+    headers = login(client, 'a@example.com')
+    assert client.get('/api/documents', query_string={'user_id': 'legacy'}, headers=headers).get_json()['documents'] == []
@@ -0,0 +1,82 @@
+"""Оба backend .docx (python-docx и потоковый) дают документ с одинаковым текстом"""
+
+import io
+import zipfile
+
+import pytest
+from lxml import etree
+
+from document_generator import DocumentGenerator
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+DATA = {
+    'company_name': 'ООО «Завод» & партнеры <Север>',
+    'business_area': 'Машиностроение',
+    'process_name': 'Сборка узла',
+    'target_audience': 'Слесари-сборщики',
+    'version': '2.1',
+    'creation_date': '01.02.2026',
+    'process_steps': '1. Подготовить детали 2. Затянуть болты М8 моментом 3.5 Н·м 3. Проверить зазор',
+    'required_resources': 'Ключ\tдинамометрический, перчатки',
+    'expected_results': 'Узел собран\x0bбез замечаний',
+    'author': 'Иванов И.И.'
+}
+
+ANSWERS = {
+    'q1': 'ООО «Завод»',
+    'q2': 'Сборка узла',
+    'q3': 'Слесарь 4 разряда',
+    'q4': 'Сборка узла\x0bперед покраской',
+    'q5': '1. Подготовить детали\n2) Затянуть\tболты\n- Проверить зазор',
+    'q6': '• Перчатки\n• Очки\x01',
+    'q7': 'Момент затяжки\r\nЗазор 0,5 мм',
+    'q8': 'Узел готов к покраске'
+}
+
+
+@pytest.fixture(scope='module')
+def generator():
+    return DocumentGenerator()
+
+
+def paragraphs(data):
+    """Текст абзацев word/document.xml: w:tab - табуляция, w:br - перевод строки"""
+    root = etree.fromstring(zipfile.ZipFile(io.BytesIO(data)).read('word/document.xml'))
+    result = []
+    for paragraph in root.iter(f'{W}p'):
+        text = []
+        for element in paragraph.iter(f'{W}t', f'{W}tab', f'{W}br'):
+            if element.tag == f'{W}t':
+                text.append(element.text or '')
+            else:
+                text.append('\t' if element.tag == f'{W}tab' else '\n')
+        result.append(''.join(text))
+    return result
+
+
+def saved(doc):
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize('doc_type', ['sok', 'instruction', 'procedure'])
+def test_document_text_matches(generator, doc_type):
+    reference = saved(getattr(generator, f'generate_{doc_type}_docx')(DATA))
+    streamed = b''.join(getattr(generator, f'stream_{doc_type}_docx')(DATA))
+    assert paragraphs(streamed) == paragraphs(reference)
+
+
+def test_wizard_text_matches(generator):
+    reference = generator.render_wizard_bytes(ANSWERS, '01.02.2026', backend='python-docx')
+    streamed = generator.render_wizard_bytes(ANSWERS, '01.02.2026', backend='stream')
+    assert paragraphs(streamed) == paragraphs(reference)
+
+
+def test_control_characters(generator):
+    streamed = generator.render_wizard_bytes(ANSWERS, '01.02.2026', backend='stream')
+    text = '\n'.join(paragraphs(streamed))
+    assert '\x01' not in text and '\x0b' not in text
+    assert 'Затянуть\tболты' in text
+    assert 'Сборка узла\nперед покраской' in text
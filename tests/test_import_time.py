@@ -0,0 +1,21 @@
+"""Холодный импорт приложения укладывается в бюджет и не тянет стек рендера"""
+
+import pytest
+
+from importtime_report import best_of, default_budget_ms, eager_modules
+
+
+@pytest.fixture(scope='module')
+def app_import():
+    return best_of('app', runs=3)
+
+
+def test_import_within_budget(app_import):
+    total, _ = app_import
+    budget = default_budget_ms()
+    assert total / 1000 <= budget, f"импорт app занял {total / 1000:.1f} мс при бюджете {budget:.0f} мс"
+
+
+def test_render_stack_loaded_lazily(app_import):
+    _, modules = app_import
+    assert eager_modules(modules) == []
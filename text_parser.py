@@ -0,0 +1,72 @@
+"""
+Разбор текстовых ответов на шаги и списки
+Один разбор на все форматы (.docx, HTML, PDF): одинаковый текст дает одинаковые пункты.
+Шаблоны скомпилированы заранее, результаты кэшируются по хэшу текста в пределах
+бюджета по байтам, пункты возвращаются неизменяемым кортежем строк
+"""
+
+import hashlib
+import re
+import sys
+
+from metrics import metrics
+from render_cache import RenderCache
+
+# Номер шага внутри сплошного текста: "1. ... 2. ..."; "3.5 мм" номером не считается
+STEP_MARKER = re.compile(r'(?<!\S)\d+\.(?!\d)')
+# Без нумерации текст делится на предложения
+SENTENCE_END = re.compile(r'\.(?!\d)')
+# Пункт списка - непустая строка; маркер "1.", "1)", "-", "*", "•" в начале отбрасывается
+LIST_ITEM = re.compile(r'^[^\S\n]*(?:(?:\d+[.)]|[-*•–])[^\S\n]+)?(.*\S)', re.MULTILINE)
+
+EMPTY_VALUES = ('', 'Не указано')
+
+# Ключ - хэш текста, а не сам текст: длинные ответы не держатся в памяти дважды
+CACHE_BYTES = 8 * 1024 * 1024
+_cache = RenderCache(max_bytes=CACHE_BYTES)
+
+
+def _cached(kind, text, parse):
+    key = f"{kind}:{hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()}"
+    items = _cache.get(key)
+    if items is None:
+        items = parse(text)
+        _cache.put(key, items, size=sys.getsizeof(items) + sum(map(sys.getsizeof, items)))
+    return items
+
+
+def _split_steps(text):
+    with metrics.stage('parse_steps'):
+        pieces = STEP_MARKER.split(text)
+        if len(pieces) == 1:
+            pieces = SENTENCE_END.split(text)
+        return tuple(piece for piece in map(str.strip, pieces) if piece)
+
+
+def _split_list(text):
+    with metrics.stage('parse_steps'):
+        return tuple(LIST_ITEM.findall(text))
+
+
+def parse_steps(text):
+    """Шаги из process_steps: по номерам "N.", а без них - по предложениям"""
+    if text is None or text in EMPTY_VALUES:
+        return ()
+    return _cached('steps', text, _split_steps)
+
+
+def parse_list(text):
+    """Пункты из ответа "по одному на строку" (q5 - шаги, q6, q7 - маркированные списки)"""
+    if not text:
+        return ()
+    return _cached('list', text, _split_list)
+
+
+def cache_stats():
+    stats = _cache.stats()
+    return {
+        "hits": stats["hits"],
+        "misses": stats["misses"],
+        "entries": stats["entries"],
+        "bytes": stats["bytes"]
+    }